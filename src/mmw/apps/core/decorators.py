@@ -32,9 +32,13 @@ def log_request(view):
         response_time = now() - requested_at
         response_ms = int(response_time.total_seconds() * 1000)
 
+        # Responses such as 304 Not Modified have no data
+        job_uuid = view_result.data.get('job', None) \
+            if view_result.data else None
+
         log = RequestLog.objects.create(
             user=user,
-            job_uuid=view_result.data.get('job', None),
+            job_uuid=job_uuid,
             requested_at=requested_at,
             response_ms=response_ms,
             status_code=view_result.status_code,
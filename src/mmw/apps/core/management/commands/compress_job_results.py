@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from apps.core.models import Job
+
+
+class Command(BaseCommand):
+    """
+    Move existing job results to the compressed result column, or back with
+    --decompress. Run after enabling MMW_JOB_RESULT_COMPRESSION, or before
+    disabling it. With --dry-run, only reports the row sizes and decode times
+    that compressing would give.
+    """
+
+    help = 'Compress stored job results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Report sizes and timings without saving.')
+        parser.add_argument('--decompress', action='store_true',
+                            default=False,
+                            help='Move compressed results back to text.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of jobs to load at a time.')
+
+    def handle(self, *args, **options):
+        if options['decompress']:
+            jobs = Job.objects.filter(compressed_result__isnull=False)
+        else:
+            jobs = Job.objects.filter(compressed_result__isnull=True) \
+                              .exclude(result='')
+
+        count = parsed = text_size = compressed_size = 0
+        text_secs = compressed_secs = 0.0
+
+        for job in self.batches(jobs, options['batch_size']):
+            if options['decompress']:
+                compressed = bytes(job.compressed_result)
+                text = zlib.decompress(compressed)
+            else:
+                text = job.result.encode('utf-8')
+                compressed = zlib.compress(text)
+
+            count += 1
+            text_size += len(text)
+            compressed_size += len(compressed)
+
+            # Results of failed or old jobs may not be JSON, and are left
+            # out of the parse timings
+            try:
+                start = time.time()
+                json.loads(text)
+                text_secs += time.time() - start
+
+                start = time.time()
+                json.loads(zlib.decompress(compressed))
+                compressed_secs += time.time() - start
+
+                parsed += 1
+            except ValueError:
+                pass
+
+            if options['dry_run']:
+                continue
+
+            if options['decompress']:
+                Job.objects.filter(id=job.id).update(
+                    result=text.decode('utf-8'), compressed_result=None)
+            else:
+                Job.objects.filter(id=job.id).update(
+                    result='', compressed_result=compressed)
+
+        if not count:
+            self.stdout.write('No job results to convert')
+            return
+
+        self.stdout.write('{} {} job results'.format(
+            'Would convert' if options['dry_run'] else 'Converted', count))
+        self.stdout.write(
+            'Text:       {:>12,} bytes, {:>10,.0f} bytes per row'.format(
+                text_size, text_size / count))
+        self.stdout.write(
+            'Compressed: {:>12,} bytes, {:>10,.0f} bytes per row'.format(
+                compressed_size, compressed_size / count))
+        if text_size:
+            self.stdout.write(
+                'Compressed rows are {:.1%} of the size of text rows'.format(
+                    compressed_size / text_size))
+
+        if parsed:
+            self.stdout.write(
+                'Parsing {} JSON results took {:.3f} ms per row as text and '
+                '{:.3f} ms per row compressed'.format(
+                    parsed, text_secs * 1000 / parsed,
+                    compressed_secs * 1000 / parsed))
+        else:
+            self.stdout.write('No JSON results to time parsing')
+
+    def batches(self, jobs, batch_size):
+        """
+        Yields the given jobs, ordered by id, loading batch_size at a time
+        so that large results are not all held in memory at once.
+        """
+        last_id = 0
+        while True:
+            batch = jobs.filter(id__gt=last_id) \
+                        .order_by('id') \
+                        .only('id', 'result', 'compressed_result')
+            batch = list(batch[:batch_size])
+            if not batch:
+                return
+            for job in batch:
+                yield job
+            last_id = batch[-1].id
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_job_uuid_unique_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='compressed_result',
+            field=models.BinaryField(help_text='zlib compressed JSON result, used instead of result when set', null=True),
+        ),
+    ]
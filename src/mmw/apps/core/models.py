@@ -2,6 +2,9 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
+import zlib
+
 from django.db import models
 from django.conf import settings
 
@@ -17,6 +20,10 @@ class Job(models.Model):
     model_input = models.TextField()
     created_at = models.DateTimeField()
     result = models.TextField()
+    compressed_result = models.BinaryField(
+        null=True,
+        help_text='zlib compressed JSON result, used instead of result '
+                  'when set')
     delivered_at = models.DateTimeField(null=True)
     error = models.TextField()
     traceback = models.TextField()
@@ -25,6 +32,33 @@ class Job(models.Model):
     def __unicode__(self):
         return unicode(self.uuid)
 
+    def set_result(self, result):
+        """
+        Stores the given result as JSON, compressed if
+        settings.JOB_RESULT_COMPRESSION is enabled.
+        """
+        result_json = json.dumps(result)
+        if settings.JOB_RESULT_COMPRESSION:
+            self.result = ''
+            self.compressed_result = zlib.compress(result_json)
+        else:
+            self.result = result_json
+            self.compressed_result = None
+
+    def get_result_json(self):
+        """
+        Returns the stored JSON result, decompressing it if needed.
+        """
+        if self.compressed_result is not None:
+            return zlib.decompress(bytes(self.compressed_result))
+        return self.result
+
+    def get_result(self):
+        """
+        Returns the stored result, parsed from JSON.
+        """
+        return json.loads(self.get_result_json())
+
 
 class RequestLog(models.Model):
     user = models.ForeignKey(AUTH_USER_MODEL,
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+JOB_FINISHED_CHANNEL = 'job_finished:{}'
+
+
+def publish_job_finished(job_uuid):
+    """
+    Announces over Redis pub/sub that the given job has finished, waking up
+    any requests waiting on it in `wait_for_job_finished`.
+    """
+    try:
+        redis = get_redis_connection('default')
+        redis.publish(JOB_FINISHED_CHANNEL.format(job_uuid), 'finished')
+    except Exception as e:
+        # Waiting requests will time out and be polled again instead
+        logger.warning('Could not publish job {} finished: {}'.format(
+            job_uuid, e))
+
+
+def wait_for_job_finished(job_uuid, timeout, is_finished):
+    """
+    Blocks until the given job is announced finished, or up to timeout
+    seconds. Since the job may finish before we start listening,
+    `is_finished` is called once listening to check for that.
+
+    Returns True if the job finished, and False if it timed out or Redis
+    is not available to wait on.
+    """
+    try:
+        pubsub = get_redis_connection('default') \
+            .pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(JOB_FINISHED_CHANNEL.format(job_uuid))
+    except Exception as e:
+        logger.warning('Could not wait for job {}: {}'.format(job_uuid, e))
+        return is_finished()
+
+    try:
+        if is_finished():
+            return True
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if pubsub.get_message(timeout=deadline - time.time()):
+                return True
+
+        return False
+    finally:
+        pubsub.close()
@@ -7,8 +7,8 @@ from django_statsd.clients import statsd
 from django.utils.timezone import now
 from celery import shared_task
 from apps.core.models import Job
+from apps.core.notifications import publish_job_finished
 
-import json
 import logging
 
 
@@ -36,6 +36,7 @@ def save_job_error(request, exc, traceback, job_id):
         job.delivered_at = now()
         job.status = 'failed'
         job.save()
+        publish_job_finished(job.uuid)
     except Exception as e:
         logger.error('Failed to save job error status. Job will appear hung. \
                      Job Id: {0}'.format(job.id))
@@ -50,9 +51,10 @@ def save_job_result(self, result, id, model_input):
     Updates a job row in the database with final results.
     """
     job = Job.objects.get(id=id)
-    job.result = json.dumps(result)
+    job.set_result(result)
     job.delivered_at = now()
     job.uuid = self.request.id
     job.model_input = model_input
     job.status = 'complete'
     job.save()
+    publish_job_finished(job.uuid)
@@ -3,4 +3,54 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
-# Create your tests here.
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from apps.core.models import Job
+
+
+class JobResultTestCase(TestCase):
+    result = {'SummaryLoads': [{'Source': 'Total Loads', 'TotalN': 1.5}],
+              'watershed_id': None}
+
+    def saved_job(self):
+        job = Job.objects.create(created_at=now(), result='', error='',
+                                 traceback='', status='started')
+        job.set_result(self.result)
+        job.save()
+        return Job.objects.get(id=job.id)
+
+    @override_settings(JOB_RESULT_COMPRESSION=False)
+    def test_uncompressed_result(self):
+        job = self.saved_job()
+
+        self.assertIsNone(job.compressed_result)
+        self.assertEqual(job.get_result(), self.result)
+
+    @override_settings(JOB_RESULT_COMPRESSION=True)
+    def test_compressed_result(self):
+        job = self.saved_job()
+
+        self.assertEqual(job.result, '')
+        self.assertIsNotNone(job.compressed_result)
+        self.assertEqual(job.get_result(), self.result)
+
+    @override_settings(JOB_RESULT_COMPRESSION=False)
+    def test_compress_job_results_skips_text_results(self):
+        json_job = self.saved_job()
+        text_job = Job.objects.create(created_at=now(), result='Failed',
+                                      error='', traceback='', status='failed')
+        out = StringIO()
+
+        call_command('compress_job_results', stdout=out)
+
+        self.assertIn('Converted 2 job results', out.getvalue())
+        self.assertIn('Parsing 1 JSON results', out.getvalue())
+        self.assertEqual(Job.objects.get(id=json_job.id).get_result(),
+                         self.result)
+        self.assertEqual(Job.objects.get(id=text_job.id).get_result_json(),
+                         'Failed')
@@ -52,7 +52,7 @@ def update_resource(user_id, project_id, params):
         if muuid:
             try:
                 job = Job.objects.get(uuid=muuid)
-                mdata = json.loads(job.result)
+                mdata = job.get_result()
                 files.append({
                     'name': md.get('name'),
                     'contents': to_gms_file(mdata),
@@ -108,7 +108,7 @@ def create_resource(user_id, project_id, params):
         if muuid:
             try:
                 job = Job.objects.get(uuid=muuid)
-                mdata = json.loads(job.result)
+                mdata = job.get_result()
                 files.append({
                     'name': md.get('name'),
                     'contents': to_gms_file(mdata),
@@ -4,17 +4,31 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import json
+from functools import wraps
 from operator import itemgetter
 
+from django_statsd.clients import statsd
+
 from django.contrib.gis.geos import GEOSGeometry
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 
+from apps.modeling.calcs import within_perimeter
+from apps.modeling.geoprocessing import safe_shape_cache_id
 from apps.modeling.mapshed.calcs import (animal_energy_units,
                                          get_point_source_table)
 
-DRB = settings.DRB_SIMPLE_PERIMETER
+CATCHMENT_WATER_QUALITY_COLUMNS = [
+    'nord', 'areaha', 'tn_tot_kgy', 'tp_tot_kgy', 'tss_tot_kg',
+    'tn_urban_k', 'tn_riparia', 'tn_ag_kgyr', 'tn_natural', 'tn_pt_kgyr',
+    'tp_urban_k', 'tp_riparia', 'tp_ag_kgyr', 'tp_natural', 'tp_pt_kgyr',
+    'tss_urban_', 'tss_rip_kg', 'tss_ag_kgy', 'tss_natura',
+    'tn_yr_avg_', 'tp_yr_avg_', 'tss_concmg',
+]
+
+MIN_SUMMED_INTERSECTION_PCT = 2
 
 ANIMAL_DISPLAY_NAMES = {
     'sheep': 'Sheep',
@@ -28,6 +42,48 @@ ANIMAL_DISPLAY_NAMES = {
 }
 
 
+def cached_survey(name):
+    """
+    Decorator for functions that compute a survey from PostGIS tables given
+    a GeoJSON shape, which caches their results for
+    settings.ANALYZE_CACHE_TIMEOUT seconds. The decorated function takes an
+    optional `wkaoi` argument, to cache the results of well-known areas of
+    interest under, and otherwise caches them under the hash of the shape,
+    if it can be normalized.
+    Cache keys include settings.ANALYZE_SUMMARY_VERSION, so that results for
+    old data are not used after it is incremented.
+    """
+    def decorator(calc):
+        @wraps(calc)
+        def wrapper(geojson, wkaoi=None):
+            shape_id = wkaoi or safe_shape_cache_id([geojson])
+            if not shape_id:
+                return calc(geojson)
+
+            key = analyze_cache_key(name, shape_id)
+            result = cache.get(key)
+
+            if result is not None:
+                statsd.incr(__name__ + '.cache.hit')
+                return result
+
+            statsd.incr(__name__ + '.cache.miss')
+            result = calc(geojson)
+            cache.set(key, result, settings.ANALYZE_CACHE_TIMEOUT)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def analyze_cache_key(name, shape_id):
+    return 'analyze_{}__{}__{}'.format(name, shape_id,
+                                       settings.ANALYZE_SUMMARY_VERSION)
+
+
+@cached_survey('animals')
 def animal_population(geojson):
     """
     Given a GeoJSON shape, call MapShed's `animal_energy_units` method
@@ -51,41 +107,14 @@ def animal_population(geojson):
     }
 
 
-def stream_data(results, geojson):
+def stream_data(results, geojson, wkaoi=None):
     """
     Given a GeoJSON shape, retreive stream data from the `nhdflowline` table
     to display in the Analyze tab
 
     Returns a dictionary to append to outgoing JSON for analysis results.
     """
-
-    NULL_SLOPE = -9998.0
-
-    sql = '''
-        SELECT sum(lengthkm) as lengthkm,
-               stream_order,
-               sum(lengthkm * NULLIF(slope, {NULL_SLOPE})) as slopesum
-        FROM nhdflowline
-        WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
-        GROUP BY stream_order;
-        '''.format(NULL_SLOPE=NULL_SLOPE)
-
-    with connection.cursor() as cursor:
-        cursor.execute(sql, [geojson])
-
-        if cursor.rowcount:
-            columns = [col[0] for col in cursor.description]
-            streams = [
-                dict(zip(columns,
-                         [
-                             float(row[0]) if row[0] else 0,
-                             int(row[1]) if row[1] and row[1] != 0 else 999,
-                             float(row[2]) if row[2] else None,
-                         ]))
-                for row in cursor.fetchall()
-            ]
-        else:
-            streams = []
+    streams = stream_order_lengths(geojson, wkaoi)
 
     def calculate_avg_slope(slope, length):
         if slope and length:
@@ -120,6 +149,45 @@ def stream_data(results, geojson):
     }
 
 
+@cached_survey('stream_order_lengths')
+def stream_order_lengths(geojson):
+    """
+    Given a GeoJSON shape, returns the length and slope sum of the streams of
+    each stream order in the `nhdflowline` table within it.
+    """
+
+    NULL_SLOPE = -9998.0
+
+    sql = '''
+        SELECT sum(lengthkm) as lengthkm,
+               stream_order,
+               sum(lengthkm * NULLIF(slope, {NULL_SLOPE})) as slopesum
+        FROM nhdflowline
+        WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
+        GROUP BY stream_order;
+        '''.format(NULL_SLOPE=NULL_SLOPE)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [geojson])
+
+        if cursor.rowcount:
+            columns = [col[0] for col in cursor.description]
+            streams = [
+                dict(zip(columns,
+                         [
+                             float(row[0]) if row[0] else 0,
+                             int(row[1]) if row[1] and row[1] != 0 else 999,
+                             float(row[2]) if row[2] else None,
+                         ]))
+                for row in cursor.fetchall()
+            ]
+        else:
+            streams = []
+
+    return streams
+
+
+@cached_survey('pointsource')
 def point_source_pollution(geojson):
     """
     Given a GeoJSON shape, retrieve point source pollution data
@@ -130,7 +198,7 @@ def point_source_pollution(geojson):
     results.
     """
     geom = GEOSGeometry(geojson, srid=4326)
-    drb = geom.within(DRB)
+    drb = within_perimeter(geom, 'DRB_SIMPLE_PERIMETER')
     table_name = get_point_source_table(drb)
     sql = '''
           SELECT city, state, npdes_id, mgd, kgn_yr, kgp_yr, latitude,
@@ -166,30 +234,68 @@ def point_source_pollution(geojson):
     }
 
 
+@cached_survey('catchment_water_quality')
 def catchment_water_quality(geojson):
     """
     Given a GeoJSON shape, retrieve Catchment Water Quality data
     from the `drb_catchment_water_quality` table to display
     in the Analyze tab.
 
+    Catchments that only abut the shape are filtered out in the query, as
+    described in `catchment_intersects_aoi`, so that only the simplified
+    geometries of the included catchments are serialized and returned.
+
     Returns a dictionary to append to the outgoing JSON for analysis
     result
     """
     geom = GEOSGeometry(geojson, srid=4326)
+    aoi_area = geom.transform(5070, clone=True).area
     table_name = 'drb_catchment_water_quality'
     sql = '''
-          SELECT nord, areaha, tn_tot_kgy, tp_tot_kgy, tss_tot_kg,
-          tn_urban_k, tn_riparia, tn_ag_kgyr, tn_natural, tn_pt_kgyr,
-          tp_urban_k, tp_riparia, tp_ag_kgyr, tp_natural, tp_pt_kgyr,
-          tss_urban_, tss_rip_kg, tss_ag_kgy, tss_natura,
-          tn_yr_avg_, tp_yr_avg_, tss_concmg,
-          ST_AsGeoJSON(ST_Simplify(geom, 0.0003)) as geom
-          FROM {table_name}
-          WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromText(%s), 4326))
-          '''.format(table_name=table_name)
+          WITH aoi AS (
+            SELECT geom, ST_Transform(geom, 5070) AS projected_geom
+            FROM ST_SetSRID(ST_GeomFromText(%(aoi)s), 4326) AS geom
+          ), simplified AS (
+            SELECT {columns}, ST_Simplify(c.geom, 0.0003) AS simple_geom
+            FROM {table_name} c, aoi
+            WHERE ST_Intersects(c.geom, aoi.geom)
+          ), projected AS (
+            SELECT {columns}, simple_geom,
+                   ST_Area(simple_geom) AS area,
+                   ST_Transform(simple_geom, 5070) AS projected_geom
+            FROM simplified
+          ), intersections AS (
+            SELECT {columns}, simple_geom, area,
+                   ST_Area(p.projected_geom) AS projected_area,
+                   CASE WHEN ST_IsValid(p.projected_geom)
+                        THEN ST_Area(ST_Intersection(p.projected_geom,
+                                                     aoi.projected_geom))
+                   END AS intersection_area
+            FROM projected p, aoi
+          ), percentages AS (
+            SELECT {columns}, simple_geom, area, projected_area,
+                   intersection_area / NULLIF(projected_area, 0) * 100
+                     AS catchment_pct,
+                   intersection_area / NULLIF(%(aoi_area)s, 0) * 100
+                     AS aoi_pct
+            FROM intersections
+          )
+          SELECT {columns}, ST_AsGeoJSON(simple_geom) AS geom
+          FROM percentages
+          WHERE area = 0
+             OR projected_area = 0
+             OR ((aoi_pct > %(min_pct)s OR catchment_pct > %(min_pct)s)
+                 AND aoi_pct + catchment_pct > %(min_summed_pct)s)
+          '''.format(table_name=table_name,
+                     columns=', '.join(CATCHMENT_WATER_QUALITY_COLUMNS))
 
     with connection.cursor() as cursor:
-        cursor.execute(sql, [geom.wkt])
+        cursor.execute(sql, {
+            'aoi': geom.wkt,
+            'aoi_area': aoi_area,
+            'min_pct': min_intersection_pct(aoi_area),
+            'min_summed_pct': MIN_SUMMED_INTERSECTION_PCT,
+        })
 
         if cursor.rowcount != 0:
             columns = [col[0] for col in cursor.description]
@@ -206,21 +312,23 @@ def catchment_water_quality(geojson):
         else:
             catchment_water_quality_results = []
 
-    # Create a reprojected version of the input geometry in order to check the
-    # amount of intersection with the water quality catchment geoms.
-    reprojected_aoi_geom = geom.transform(5070, clone=True)
-
-    adjusted_wq_results = [r for r in catchment_water_quality_results if
-                           catchment_intersects_aoi(reprojected_aoi_geom,
-                                                    r['geom'])]
-
     return {
         'displayName': 'Water Quality',
         'name': 'catchment_water_quality',
-        'categories': adjusted_wq_results
+        'categories': catchment_water_quality_results
     }
 
 
+def min_intersection_pct(aoi_area):
+    """
+    Returns the percentage of a catchment's or an area of interest's area
+    that their intersection must be greater than, for an area of interest
+    of the given area in square meters.
+    """
+    aoi_kms = aoi_area / 1000000
+    return min(5, max(0.1, aoi_kms / 1000))
+
+
 def catchment_intersects_aoi(aoi, catchment):
     """Check whether a catchment geometry intersects an area of interest by
     more than a minimum value.
@@ -247,7 +355,11 @@ def catchment_intersects_aoi(aoi, catchment):
 
     As an additional guard, we also check that the sum of the catchment's
     intersection percentage and the area of interest's intersection percentage
-    is greater than a `min_summed_intersection_pct`, set to 2%.
+    is greater than `MIN_SUMMED_INTERSECTION_PCT`, set to 2%.
+
+    This is the same filter that `catchment_water_quality` applies in its
+    query, for a single catchment, and is kept as the reference the query is
+    tested against.
     """
     catchment_geom = GEOSGeometry(json.dumps(catchment), srid=4326)
     reprojected_catchment = catchment_geom.transform(5070, clone=True)
@@ -261,9 +373,7 @@ def catchment_intersects_aoi(aoi, catchment):
     elif not reprojected_catchment.valid:
         return False
 
-    aoi_kms = aoi.area / 1000000
-    min_intersection_pct = min(5, max(0.1, aoi_kms / 1000))
-    min_summed_intersection_pct = 2
+    min_pct = min_intersection_pct(aoi.area)
 
     intersection_area = reprojected_catchment.intersection(aoi).area
 
@@ -272,9 +382,9 @@ def catchment_intersects_aoi(aoi, catchment):
 
     aoi_intersection_pct = ((intersection_area / aoi.area) * 100)
 
-    include_catchment = ((aoi_intersection_pct > min_intersection_pct or
-                         catchment_intersection_pct > min_intersection_pct) and
+    include_catchment = ((aoi_intersection_pct > min_pct or
+                         catchment_intersection_pct > min_pct) and
                          aoi_intersection_pct + catchment_intersection_pct >
-                         min_summed_intersection_pct)
+                         MIN_SUMMED_INTERSECTION_PCT)
 
     return include_catchment
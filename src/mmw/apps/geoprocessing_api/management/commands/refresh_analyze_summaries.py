@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from rest_framework.exceptions import ValidationError
+
+from apps.modeling.calcs import _get_boundary_layer_by_code
+from apps.modeling.serializers import AoiSerializer
+from apps.geoprocessing_api.calcs import analyze_cache_key
+from apps.geoprocessing_api.models import AnalyzeSummary
+from apps.geoprocessing_api.tasks import SUMMARY_SURVEYS
+
+BOUNDARY_CODES = ['huc8', 'huc10', 'huc12', 'county']
+
+
+class Command(BaseCommand):
+    """
+    Precompute the Analyze surveys that only depend on static tables, for the
+    given well-known areas of interest, or all those of the given boundary
+    layers, and store them for the current settings.ANALYZE_SUMMARY_VERSION.
+    Run after each data load, having incremented the version. Areas of
+    interest with summaries of the current version are skipped, unless
+    --force is given, which also recomputes their cached surveys.
+    """
+
+    help = 'Precompute the Analyze surveys of well-known areas of interest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('wkaoi', nargs='*',
+                            help='Well-known areas of interest to refresh, '
+                                 'like "huc12__55174".')
+        parser.add_argument('--boundary', action='append',
+                            choices=BOUNDARY_CODES,
+                            help='Refresh all areas of interest of this '
+                                 'boundary layer. May be repeated. Defaults '
+                                 'to all of {}, if no areas of interest are '
+                                 'given.'.format(', '.join(BOUNDARY_CODES)))
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='Refresh summaries of the current version.')
+
+    def handle(self, *args, **options):
+        wkaois = options['wkaoi']
+        if options['boundary'] or not wkaois:
+            wkaois = wkaois + self.boundary_wkaois(options['boundary'] or
+                                                   BOUNDARY_CODES)
+
+        version = settings.ANALYZE_SUMMARY_VERSION
+        if not options['force']:
+            current = set(AnalyzeSummary.objects
+                          .filter(data_version=version)
+                          .values_list('wkaoi', flat=True))
+            wkaois = [wkaoi for wkaoi in wkaois if wkaoi not in current]
+
+        self.stdout.write(
+            'Refreshing {} areas of interest for version {}'.format(
+                len(wkaois), version))
+
+        for count, wkaoi in enumerate(wkaois, 1):
+            try:
+                serializer = AoiSerializer(data={'wkaoi': wkaoi})
+                serializer.is_valid(raise_exception=True)
+            except ValidationError:
+                self.stdout.write(
+                    'Skipping unknown area of interest {}'.format(wkaoi))
+                continue
+
+            aoi = serializer.validated_data['area_of_interest']
+
+            # Otherwise the surveys would be read back from the cache
+            if options['force']:
+                cache.delete_many([analyze_cache_key(name, wkaoi)
+                                   for name in SUMMARY_SURVEYS])
+
+            surveys = {name: calc(aoi, wkaoi)
+                       for name, calc in SUMMARY_SURVEYS.iteritems()}
+
+            AnalyzeSummary.objects.update_or_create(
+                wkaoi=wkaoi,
+                defaults={'data_version': version,
+                          'surveys': json.dumps(surveys)})
+
+            if count % 100 == 0:
+                self.stdout.write('Refreshed {} of {}'.format(count,
+                                                              len(wkaois)))
+
+        self.stdout.write('Refreshed {} areas of interest'.format(len(wkaois)))
+
+    def boundary_wkaois(self, codes):
+        """
+        Returns the well-known areas of interest of the given boundary layers.
+        """
+        wkaois = []
+
+        for code in codes:
+            table = _get_boundary_layer_by_code(code)['table_name']
+            sql = '''
+                  SELECT id
+                  FROM {table}
+                  ORDER BY id
+                  '''.format(table=table)
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                wkaois.extend('{}__{}'.format(code, row[0])
+                              for row in cursor.fetchall())
+
+        return wkaois
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyzeSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('wkaoi', models.CharField(help_text='The well-known area of interest, like "huc12__55174"', unique=True, max_length=255)),
+                ('data_version', models.CharField(help_text='The ANALYZE_SUMMARY_VERSION the surveys were computed for', max_length=255)),
+                ('surveys', models.TextField(help_text='Serialized JSON dictionary of the Analyze surveys of the area of interest, keyed by their names')),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.db import models
+
+
+class AnalyzeSummary(models.Model):
+    wkaoi = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text='The well-known area of interest, like "huc12__55174"')
+    data_version = models.CharField(
+        max_length=255,
+        help_text='The ANALYZE_SUMMARY_VERSION the surveys were computed for')
+    surveys = models.TextField(
+        help_text='Serialized JSON dictionary of the Analyze surveys of the '
+                  'area of interest, keyed by their names')
+    modified_at = models.DateTimeField(
+        auto_now=True)
+
+    def __unicode__(self):
+        return self.wkaoi
+
+    @classmethod
+    def get_survey(cls, wkaoi, name):
+        """
+        Returns the precomputed survey with the given name for the given
+        well-known area of interest, if it has been computed for the current
+        settings.ANALYZE_SUMMARY_VERSION, or None otherwise.
+        """
+        try:
+            summary = cls.objects.get(
+                wkaoi=wkaoi, data_version=settings.ANALYZE_SUMMARY_VERSION)
+        except cls.DoesNotExist:
+            return None
+
+        return json.loads(summary.surveys).get(name)
@@ -7,7 +7,6 @@ import os
 import logging
 import urllib
 
-from ast import literal_eval as make_tuple
 from calendar import month_name
 
 from celery import shared_task
@@ -16,7 +15,8 @@ import requests
 
 from django.conf import settings
 
-from apps.modeling.geoprocessing import parse
+from apps.modeling.geoprocessing import NOWKAOI, parse, parse_key
+from apps.modeling.mapshed.tasks import nlcd_streams
 from apps.modeling.tr55.utils import aoi_resolution
 
 from apps.geoprocessing_api.calcs import (animal_population,
@@ -24,6 +24,7 @@ from apps.geoprocessing_api.calcs import (animal_population,
                                           catchment_water_quality,
                                           stream_data,
                                           )
+from apps.geoprocessing_api.models import AnalyzeSummary
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +37,15 @@ ACRES_PER_SQM = 0.000247105
 CM_PER_MM = 0.1
 M_PER_CM = 0.01
 
+# Surveys that only depend on the area of interest and static tables, which
+# are precomputed for well-known areas of interest by the
+# refresh_analyze_summaries management command
+SUMMARY_SURVEYS = {
+    'animals': animal_population,
+    'pointsource': point_source_pollution,
+    'catchment_water_quality': catchment_water_quality,
+}
+
 
 @shared_task
 def start_rwd_job(location, snapping, simplify, data_source):
@@ -76,37 +86,51 @@ def start_rwd_job(location, snapping, simplify, data_source):
 
 
 @shared_task
-def analyze_streams(results, area_of_interest):
+def analyze_streams(results, area_of_interest, wkaoi=None):
     """
     Given geoprocessing results with stream data and an area of interest,
     returns the streams and stream order within it.
     """
-    return {'survey': stream_data(results, area_of_interest)}
+    return {'survey': stream_data(results, area_of_interest, wkaoi)}
 
 
 @shared_task
-def analyze_animals(area_of_interest):
+def analyze_animals(area_of_interest, wkaoi=None):
     """
     Given an area of interest, returns the animal population within it.
     """
-    return {'survey': animal_population(area_of_interest)}
+    return {'survey': summary_survey('animals', area_of_interest, wkaoi)}
 
 
 @shared_task
-def analyze_pointsource(area_of_interest):
+def analyze_pointsource(area_of_interest, wkaoi=None):
     """
     Given an area of interest, returns point sources of pollution within it.
     """
-    return {'survey': point_source_pollution(area_of_interest)}
+    return {'survey': summary_survey('pointsource', area_of_interest, wkaoi)}
 
 
 @shared_task
-def analyze_catchment_water_quality(area_of_interest):
+def analyze_catchment_water_quality(area_of_interest, wkaoi=None):
     """
     Given an area of interest in the DRB, returns catchment water quality data
     within it.
     """
-    return {'survey': catchment_water_quality(area_of_interest)}
+    return {'survey': summary_survey('catchment_water_quality',
+                                     area_of_interest, wkaoi)}
+
+
+def summary_survey(name, area_of_interest, wkaoi=None):
+    """
+    Returns the precomputed survey with the given name for a well-known area
+    of interest, or computes it for the area of interest if there isn't one.
+    """
+    survey = AnalyzeSummary.get_survey(wkaoi, name) if wkaoi else None
+
+    if survey is None:
+        survey = SUMMARY_SURVEYS[name](area_of_interest, wkaoi)
+
+    return survey
 
 
 @shared_task(throws=Exception)
@@ -123,7 +147,7 @@ def analyze_nlcd(result, area_of_interest=None):
     # Convert results to histogram, calculate total
     for key, count in result.iteritems():
         total_count += count
-        histogram[make_tuple(key[4:])] = count  # Change {"List(1)":5} to {1:5}
+        histogram[parse_key(key)] = count  # Change {"List(1)":5} to {1:5}
 
     for nlcd, (code, name) in settings.NLCD_MAPPING.iteritems():
         categories.append({
@@ -157,7 +181,7 @@ def analyze_soil(result, area_of_interest=None):
     # Convert results to histogram, calculate total
     for key, count in result.iteritems():
         total_count += count
-        s = make_tuple(key[4:])  # Change {"List(1)":5} to {1:5}
+        s = parse_key(key)  # Change {"List(1)":5} to {1:5}
         s = s if s != settings.NODATA else 3  # Map NODATA to 3
         histogram[s] = count + histogram.get(s, 0)
 
@@ -179,48 +203,28 @@ def analyze_soil(result, area_of_interest=None):
 
 
 @shared_task(throws=Exception)
-def analyze_climate(result, category, month):
+def analyze_climate(result, wkaoi):
     """
-    Given a climate category ('ppt' or 'tmean') and a month (1 - 12), tags
-    the resulting value with that category and month and returns it as a
-    dictionary.
+    Given the result of the multi 'climate' operation, which has the average
+    precipitation and temperature of each month in the area of interest under
+    the labels 'ppt1', ..., 'ppt12' and 'tmean1', ..., 'tmean12', transforms
+    them into the format used for all other Analyze operations.
+
+    The 'categories' contain twelve objects, one for each month, with a
+    'month' field containing the name of the month, and 'ppt' and 'tmean'
+    fields with corresponding values. The 'index' can be used for sorting
+    purposes on the client side.
     """
     if 'error' in result:
-        raise Exception('[analyze_climate_{category}_{month}] {error}'.format(
-            category=category,
-            month=month,
-            error=result['error']
-        ))
-
-    result = parse(result)
-    key = '{}__{}'.format(category, month)
-
-    return {key: result[0]}
+        raise Exception('[analyze_climate] {}'.format(result['error']))
 
-
-@shared_task
-def collect_climate(results):
-    """
-    Given an array of dictionaries resulting from multiple analyze_climate
-    calls, combines them so that the 'ppt' values are grouped together and
-    'tmean' together. Each group is a dictionary where the keys are strings
-    of the month '1', '2', ..., '12', and the values the average in the
-    area of interest.
-
-    Then, transforms these dictionaries into a final result of the format used
-    for all other Analyze operations. The 'categories' contain twelve objects,
-    one for each month, with a 'month' field containing the name of the month,
-    and 'ppt' and 'tmean' fields with corresponding values. The 'index' can be
-    used for sorting purposes on the client side.
-    """
-    ppt = {k[5:]: v for r in results for k, v in r.items() if 'ppt' in k}
-    tmean = {k[7:]: v for r in results for k, v in r.items() if 'tmean' in k}
+    result = result[wkaoi]
 
     categories = [{
         'monthidx': i,
         'month': month_name[i],
-        'ppt': ppt[str(i)] * CM_PER_MM,
-        'tmean': tmean[str(i)],
+        'ppt': parse(result['ppt{}'.format(i)])[0] * CM_PER_MM,
+        'tmean': parse(result['tmean{}'.format(i)])[0],
     } for i in xrange(1, 13)]
 
     return {
@@ -300,3 +304,48 @@ def analyze_terrain(result):
             'categories': categories
         }
     }
+
+
+@shared_task(throws=Exception)
+def collect_analyze(results, area_of_interest, wkaoi):
+    """
+    Given the results of the group of tasks started by start_analyze, which
+    are the result of the multi 'analyze' operation, the result of the
+    'terrain' operation, and the animals, point source and catchment water
+    quality surveys, returns all the surveys of the area of interest as:
+
+        {
+            'surveys': [
+                {{ land survey }},
+                {{ soil survey }},
+                ...
+            ]
+        }
+
+    Any errors in the geoprocessing results are raised here rather than in
+    the group, so that the group is always marked as ready, and the job is
+    marked as failed by the chain's error handler.
+    """
+    analyze, terrain, animals, pointsource, water_quality = results
+
+    if 'error' in analyze:
+        raise Exception('[collect_analyze] {}'.format(analyze['error']))
+
+    rasters = analyze[wkaoi]
+
+    # There are no stream results if there are no streams in the area
+    stream_results = nlcd_streams(rasters.get('nlcd_streams', {}))
+
+    surveys = [
+        analyze_nlcd(rasters['nlcd'], area_of_interest),
+        analyze_soil(rasters['soil'], area_of_interest),
+        animals,
+        pointsource,
+        water_quality,
+        analyze_climate(analyze, wkaoi),
+        analyze_streams(stream_results, area_of_interest,
+                        wkaoi if wkaoi != NOWKAOI else None),
+        analyze_terrain(terrain),
+    ]
+
+    return {'surveys': [survey['survey'] for survey in surveys]}
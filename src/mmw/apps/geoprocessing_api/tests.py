@@ -9,12 +9,16 @@ from django.test import (Client,
                          TestCase,
                          LiveServerTestCase)
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import override_settings
 
 from rest_framework.authtoken.models import Token
 
 from django.contrib.gis.geos import GEOSGeometry
 
 from apps.geoprocessing_api import (tasks, calcs)
+from apps.geoprocessing_api.models import AnalyzeSummary
 
 
 class ExerciseManageApiToken(LiveServerTestCase):
@@ -344,6 +348,170 @@ class ExerciseAnalyze(TestCase):
         actual = tasks.analyze_soil(histogram)
         self.assertEqual(actual, expected)
 
+    def test_survey_climate(self):
+        result = {'huc12__55174': {}}
+        for month in range(1, 13):
+            result['huc12__55174']['ppt{}'.format(month)] = {
+                'List(0)': 10.0 * month}
+            result['huc12__55174']['tmean{}'.format(month)] = {
+                'List(0)': month - 6.5}
+
+        actual = tasks.analyze_climate(result, 'huc12__55174')
+        categories = actual['survey']['categories']
+
+        self.assertEqual(actual['survey']['name'], 'climate')
+        self.assertEqual(len(categories), 12)
+        self.assertEqual(categories[0], {
+            'monthidx': 1,
+            'month': 'January',
+            'ppt': 1.0,
+            'tmean': -5.5,
+        })
+        self.assertEqual(categories[11]['month'], 'December')
+        self.assertAlmostEqual(categories[11]['ppt'], 12.0)
+
+    @override_settings(ANALYZE_SUMMARY_VERSION='2')
+    def test_survey_summary(self):
+        animals = {
+            'displayName': 'Animals',
+            'name': 'animals',
+            'categories': [{'type': 'Sheep', 'aeu': 3}],
+        }
+        AnalyzeSummary.objects.create(wkaoi='huc12__55174',
+                                      data_version='2',
+                                      surveys=json.dumps({'animals': animals}))
+
+        actual = tasks.analyze_animals(None, 'huc12__55174')
+
+        self.assertEqual(actual, {'survey': animals})
+        self.assertIsNone(
+            AnalyzeSummary.get_survey('huc12__55174', 'pointsource'))
+        self.assertIsNone(AnalyzeSummary.get_survey('huc12__1', 'animals'))
+
+        with self.settings(ANALYZE_SUMMARY_VERSION='3'):
+            self.assertIsNone(
+                AnalyzeSummary.get_survey('huc12__55174', 'animals'))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class ExerciseCachedSurvey(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        @calcs.cached_survey('test')
+        def survey(geojson):
+            self.calls.append(geojson)
+            return {'name': 'test', 'categories': []}
+
+        self.survey = survey
+        self.aoi = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[-75.1, 39.9], [-75.0, 39.9], [-75.0, 40.0],
+                             [-75.1, 40.0], [-75.1, 39.9]]]
+        })
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_cached_by_shape(self):
+        shifted = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[-75.0, 39.9], [-75.0, 40.0], [-75.1, 40.0],
+                             [-75.1, 39.9], [-75.0, 39.9]]]
+        })
+
+        first = self.survey(self.aoi)
+        second = self.survey(shifted)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, [self.aoi])
+
+    def test_cached_by_wkaoi(self):
+        self.survey(self.aoi, 'huc12__55174')
+        self.survey(self.aoi, 'huc12__55174')
+        self.survey(self.aoi)
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_uncacheable_shape_is_computed(self):
+        # Collapses to two points when rounded
+        sliver = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[0, 0], [1, 0], [1, 0.0000001], [0, 0]]]
+        })
+
+        self.survey(sliver)
+        self.survey(sliver)
+
+        self.assertEqual(self.calls, [sliver, sliver])
+
+    def test_cached_by_version(self):
+        self.survey(self.aoi)
+
+        with self.settings(ANALYZE_SUMMARY_VERSION='test'):
+            self.survey(self.aoi)
+
+        self.assertEqual(len(self.calls), 2)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class ExerciseCollectAnalyze(TestCase):
+    def setUp(self):
+        self.wkaoi = 'huc12__55174'
+        self.aoi = json.dumps({
+            'type': 'MultiPolygon',
+            'coordinates': [[[[-75.1, 39.9], [-75.0, 39.9], [-75.0, 40.0],
+                              [-75.1, 40.0], [-75.1, 39.9]]]]
+        })
+        rasters = {
+            'nlcd': {'List(21)': 10, 'List(82)': 30},
+            'soil': {'List(1)': 25, 'List(3)': 15},
+            'nlcd_streams': {'List(82)': 4},
+        }
+        for month in range(1, 13):
+            rasters['ppt{}'.format(month)] = {'List(0)': 10.0}
+            rasters['tmean{}'.format(month)] = {'List(0)': 5.0}
+
+        self.analyze = {self.wkaoi: rasters}
+        self.terrain = [{'avg': 100, 'min': 0, 'max': 200},
+                        {'avg': 2.5, 'min': 0, 'max': 10}]
+        self.surveys = [{'survey': {'name': name, 'categories': []}}
+                        for name in ['animals', 'pointsource',
+                                     'catchment_water_quality']]
+
+        # Stream lengths come from PostGIS, which isn't loaded in tests
+        cache.set(calcs.analyze_cache_key('stream_order_lengths',
+                                          self.wkaoi), [])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_collect_analyze(self):
+        results = [self.analyze, self.terrain] + self.surveys
+
+        actual = tasks.collect_analyze(results, self.aoi, self.wkaoi)
+        names = [survey['name'] for survey in actual['surveys']]
+
+        self.assertEqual(names, ['land', 'soil', 'animals', 'pointsource',
+                                 'catchment_water_quality', 'climate',
+                                 'streams', 'terrain'])
+        streams = actual['surveys'][6]['categories']
+        self.assertEqual(streams[0]['ag_stream_pct'], 1.0)
+
+    def test_collect_analyze_error(self):
+        results = [{'error': 'Timeout'}, self.terrain] + self.surveys
+
+        with self.assertRaisesRegexp(Exception, 'Timeout'):
+            tasks.collect_analyze(results, self.aoi, self.wkaoi)
+
 
 class ExerciseCatchmentIntersectsAOI(TestCase):
     def test_sq_km_aoi(self):
@@ -1075,3 +1243,109 @@ class ExerciseCatchmentIntersectsAOI(TestCase):
                                                        intersecting_catchment))
         self.assertTrue(calcs.catchment_intersects_aoi(reprojected_aoi,
                                                        containing_catchment))
+
+
+def polygon(*points):
+    return json.dumps({'type': 'Polygon',
+                       'coordinates': [list(points) + [points[0]]]})
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class ExerciseCatchmentWaterQuality(TestCase):
+    def setUp(self):
+        self.aoi = polygon([-75.27900695800781, 39.891925022904516],
+                           [-75.26608943939209, 39.891925022904516],
+                           [-75.26608943939209, 39.90173657727282],
+                           [-75.27900695800781, 39.90173657727282])
+
+        catchments = {
+            # Retraces itself, so has no area
+            1: polygon([-75.275, 39.895], [-75.27, 39.895],
+                       [-75.27, 39.898], [-75.27, 39.895]),
+            # Self-intersecting bowtie, with some area
+            2: polygon([-75.277, 39.893], [-75.274, 39.894],
+                       [-75.274, 39.893], [-75.277, 39.895]),
+            # Only overlaps the area of interest by a sliver
+            3: polygon([-75.28535842895508, 39.898279646242635],
+                       [-75.27896404266357, 39.898279646242635],
+                       [-75.27896404266357, 39.90305345750681],
+                       [-75.28535842895508, 39.90305345750681]),
+            4: polygon([-75.26849269866943, 39.890838422106924],
+                       [-75.26244163513184, 39.890838422106924],
+                       [-75.26244163513184, 39.89498716884207],
+                       [-75.26849269866943, 39.89498716884207]),
+        }
+
+        # Catchments aren't loaded in tests
+        columns = calcs.CATCHMENT_WATER_QUALITY_COLUMNS
+        column_types = ['{} {}'.format(column, 'integer' if column == 'nord'
+                                       else 'numeric')
+                        for column in columns]
+        insert_sql = '''
+            INSERT INTO drb_catchment_water_quality
+            VALUES ({values}, ST_SetSRID(ST_GeomFromText(%s), 4326))
+            '''.format(values=', '.join(['%s'] * len(columns)))
+
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                CREATE TEMPORARY TABLE drb_catchment_water_quality
+                ({columns}, geom geometry(Geometry, 4326))
+                '''.format(columns=', '.join(column_types)))
+            for nord, catchment in catchments.iteritems():
+                cursor.execute(insert_sql,
+                               [nord] + [1.5] * (len(columns) - 1) +
+                               [GEOSGeometry(catchment).wkt])
+
+    def tearDown(self):
+        cache.clear()
+
+    def included_nords(self, geojson):
+        return sorted(category['nord'] for category in
+                      calcs.catchment_water_quality(geojson)['categories'])
+
+    def expected_nords(self, geojson):
+        """
+        Filters the simplified catchments intersecting the given shape with
+        `catchment_intersects_aoi`, as was done before the query filtered them
+        """
+        aoi = GEOSGeometry(geojson, srid=4326)
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT nord, ST_AsGeoJSON(ST_Simplify(geom, 0.0003))
+                FROM drb_catchment_water_quality
+                WHERE ST_Intersects(geom,
+                                    ST_SetSRID(ST_GeomFromText(%s), 4326))
+                ''', [aoi.wkt])
+            rows = cursor.fetchall()
+
+        reprojected_aoi = aoi.transform(5070, clone=True)
+        return sorted(nord for nord, geom in rows
+                      if calcs.catchment_intersects_aoi(reprojected_aoi,
+                                                        json.loads(geom)))
+
+    def test_catchments_filtered(self):
+        included = self.included_nords(self.aoi)
+
+        self.assertEqual(included, [1, 4])
+        self.assertEqual(included, self.expected_nords(self.aoi))
+
+    def test_catchment_values(self):
+        categories = calcs.catchment_water_quality(self.aoi)['categories']
+        category = [c for c in categories if c['nord'] == 4][0]
+
+        self.assertEqual(category['tn_tot_kgy'], 1.5)
+        self.assertEqual(category['geom']['type'], 'Polygon')
+
+    def test_zero_area_aoi(self):
+        # A line through the bowtie and the overlapping catchment
+        aoi = polygon([-75.276, 39.8935], [-75.265, 39.8935],
+                      [-75.265, 39.8935])
+
+        included = self.included_nords(aoi)
+
+        self.assertEqual(included, [])
+        self.assertEqual(included, self.expected_nords(aoi))
@@ -15,6 +15,7 @@ urlpatterns = patterns(
     url(r'^docs/', include('rest_framework_swagger.urls')),
     url(r'^token/', views.get_auth_token,
         name="authtoken"),
+    url(r'analyze/$', views.start_analyze, name='start_analyze'),
     url(r'analyze/land/$', views.start_analyze_land,
         name='start_analyze_land'),
     url(r'analyze/soil/$', views.start_analyze_soil,
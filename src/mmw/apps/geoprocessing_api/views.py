@@ -13,7 +13,6 @@ from rest_framework.authtoken.models import Token
 
 from django.utils.timezone import now
 from django.core.urlresolvers import reverse
-from django.conf import settings
 
 from apps.core.models import Job
 from apps.core.tasks import (save_job_error,
@@ -740,7 +739,7 @@ def start_analyze_streams(request, format=None):
                             {'polygon': [area_of_interest],
                              'vector': streams(area_of_interest)}, wkaoi),
         nlcd_streams.s(),
-        tasks.analyze_streams.s(area_of_interest)
+        tasks.analyze_streams.s(area_of_interest, wkaoi)
     ], area_of_interest, user)
 
 
@@ -851,7 +850,7 @@ def start_analyze_animals(request, format=None):
     area_of_interest, wkaoi = _parse_input(request)
 
     return start_celery_job([
-        tasks.analyze_animals.s(area_of_interest)
+        tasks.analyze_animals.s(area_of_interest, wkaoi)
     ], area_of_interest, user)
 
 
@@ -941,7 +940,7 @@ def start_analyze_pointsource(request, format=None):
     area_of_interest, wkaoi = _parse_input(request)
 
     return start_celery_job([
-        tasks.analyze_pointsource.s(area_of_interest)
+        tasks.analyze_pointsource.s(area_of_interest, wkaoi)
     ], area_of_interest, user)
 
 
@@ -1060,7 +1059,7 @@ def start_analyze_catchment_water_quality(request, format=None):
     area_of_interest, wkaoi = _parse_input(request)
 
     return start_celery_job([
-        tasks.analyze_catchment_water_quality.s(area_of_interest)
+        tasks.analyze_catchment_water_quality.s(area_of_interest, wkaoi)
     ], area_of_interest, user)
 
 
@@ -1151,29 +1150,14 @@ def start_analyze_climate(request, format=None):
 
     """
     user = request.user if request.user.is_authenticated() else None
-
-    geotasks = []
-    ppt_raster = settings.GEOP['json']['ppt']['input']['targetRaster']
-    tmean_raster = settings.GEOP['json']['tmean']['input']['targetRaster']
     area_of_interest, wkaoi = _parse_input(request)
-
-    for i in xrange(1, 13):
-        ppt_input = {'polygon': [area_of_interest],
-                     'targetRaster': ppt_raster.format(i)}
-        tmean_input = {'polygon': [area_of_interest],
-                       'targetRaster': tmean_raster.format(i)}
-
-        geotasks.extend([
-            geoprocessing.run.s('ppt', ppt_input, wkaoi, i) |
-            tasks.analyze_climate.s('ppt', i),
-            geoprocessing.run.s('tmean', tmean_input, wkaoi, i) |
-            tasks.analyze_climate.s('tmean', i)
-        ])
+    shape_id = wkaoi or geoprocessing.NOWKAOI
+    shapes = [{'id': shape_id, 'shape': area_of_interest}]
 
     return start_celery_job([
-        group(geotasks),
-        tasks.collect_climate.s(),
-    ], area_of_interest, user, link_error=False)
+        geoprocessing.multi.s('climate', shapes, None),
+        tasks.analyze_climate.s(shape_id)
+    ], area_of_interest, user)
 
 
 @decorators.api_view(['POST'])
@@ -1277,6 +1261,105 @@ def start_analyze_terrain(request, format=None):
     ], area_of_interest, user)
 
 
+@decorators.api_view(['POST'])
+@decorators.authentication_classes((SessionAuthentication,
+                                    TokenAuthentication, ))
+@decorators.permission_classes((IsAuthenticated, ))
+@decorators.throttle_classes([BurstRateThrottle, SustainedRateThrottle])
+@log_request
+def start_analyze(request, format=None):
+    """
+    Starts a job to run all analyses of a given area at once: land, soil,
+    animals, point source, catchment water quality, climate, streams and
+    terrain.
+
+    The land, soil, streams and climate analyses share a single geoprocessing
+    request, and the others run in parallel with it. Each survey is the same
+    as the `survey` of the result of its own endpoint.
+
+    ## Response
+
+    You can use the URL provided in the response's `Location`
+    header to poll for the job's results.
+
+    <summary>
+       **Example of a completed job's `result`**
+    </summary>
+
+    <details>
+
+        {
+            "surveys": [
+                {
+                    "displayName": "Land",
+                    "name": "land",
+                    "categories": [...]
+                },
+                {
+                    "displayName": "Soil",
+                    "name": "soil",
+                    "categories": [...]
+                }, ...
+            ]
+        }
+
+    </details>
+
+    ---
+    type:
+      job:
+        required: true
+        type: string
+      status:
+        required: true
+        type: string
+
+    omit_serializer: true
+    parameters:
+       - name: body
+         description: A valid single-ringed Multipolygon GeoJSON
+                      representation of the shape to analyze.
+                      See the GeoJSON spec
+                      https://tools.ietf.org/html/rfc7946#section-3.1.7
+         paramType: body
+         type: object
+       - name: wkaoi
+         description: The table and ID for a well-known area of interest,
+                      such as a HUC.
+                      Format "table__id", eg. "huc12__55174" will analyze
+                      the HUC-12 City of Philadelphia-Schuylkill River.
+         type: string
+         paramType: query
+
+       - name: Authorization
+         paramType: header
+         description: Format "Token&nbsp;YOUR_API_TOKEN_HERE". When using
+                      Swagger you may wish to set this for all requests via
+                      the field at the top right of the page.
+    consumes:
+        - application/json
+    produces:
+        - application/json
+    """
+    user = request.user if request.user.is_authenticated() else None
+    area_of_interest, wkaoi = _parse_input(request)
+    shape_id = wkaoi or geoprocessing.NOWKAOI
+    shapes = [{'id': shape_id, 'shape': area_of_interest}]
+    stream_lines = streams(area_of_interest)[0]
+
+    return start_celery_job([
+        group([
+            geoprocessing.multi.s('analyze', shapes, stream_lines),
+            geoprocessing.run.s('terrain', {'polygon': [area_of_interest]},
+                                wkaoi),
+            tasks.analyze_animals.s(area_of_interest, wkaoi),
+            tasks.analyze_pointsource.s(area_of_interest, wkaoi),
+            tasks.analyze_catchment_water_quality.s(area_of_interest, wkaoi),
+        ]),
+        tasks.collect_analyze.s(area_of_interest, shape_id)
+    ], area_of_interest, user)
+
+
 def _initiate_rwd_job_chain(location, snapping, simplify, data_source,
                             job_id, testing=False):
     errback = save_job_error.s(job_id)
@@ -4,17 +4,21 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import json
+import os
 
 from copy import deepcopy
+from threading import local
 
 from django.conf import settings
 from django.db import connection
 
-from django.contrib.gis.geos import WKBReader
+from django.contrib.gis.geos import GEOSGeometry, WKBReader
 
 
 HECTARES_PER_SQM = 0.0001
 
+_perimeters = local()
+
 
 def split_into_huc12s(code, id):
     layer = _get_boundary_layer_by_code(code)
@@ -269,8 +273,87 @@ def _do_boundary_search(search_term):
     return result
 
 
+def get_drb_point_sources(bbox=None):
+    """
+    Fetch the DRB point sources as a serialized GeoJSON FeatureCollection,
+    built by PostGIS.
+
+    :param bbox: Optional (xmin, ymin, xmax, ymax) tuple, in EPSG:4326, to
+                 limit the point sources to
+    :return: GeoJSON FeatureCollection string
+    """
+    where, params = '', []
+    if bbox:
+        where = 'WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)'
+        params = list(bbox)
+
+    sql = '''
+          SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', COALESCE(json_agg(json_build_object(
+              'type', 'Feature',
+              'geometry', json_build_object(
+                'type', 'Point',
+                'coordinates', json_build_array(ST_X(geom), ST_Y(geom))),
+              'properties', json_build_object(
+                'city', city,
+                'state', state,
+                'npdes_id', npdes_id,
+                'mgd', NULLIF(mgd, 0)::float,
+                'kgn_yr', NULLIF(kgn_yr, 0)::float,
+                'kgp_yr', NULLIF(kgp_yr, 0)::float,
+                'facilityname', facilityname))), '[]'))::text
+          FROM ms_pointsource_drb
+          {where}
+          '''.format(where=where)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+
+
 def _get_boundary_layer_by_code(code):
     for layer in settings.LAYER_GROUPS['boundary']:
         if layer.get('code') == code:
             return layer
     return False
+
+
+def within_perimeter(geom, name):
+    """
+    Returns whether the given geometry is within the perimeter in the setting
+    with the given name, like 'DRB_PERIMETER'.
+
+    The perimeters are detailed multipolygons, so they are prepared once, and
+    geometries outside their bounding boxes are rejected without running the
+    predicate.
+    """
+    prepared, (xmin, ymin, xmax, ymax) = _get_prepared_perimeter(name)
+    gxmin, gymin, gxmax, gymax = geom.extent
+
+    if gxmin < xmin or gymin < ymin or gxmax > xmax or gymax > ymax:
+        return False
+
+    return prepared.contains(geom)
+
+
+def _get_prepared_perimeter(name):
+    """
+    Returns the prepared geometry and extent of the perimeter in the setting
+    with the given name, which is either a GEOSGeometry or a GeoJSON Feature.
+    Prepared geometries can't be used concurrently, so each thread of each
+    process has its own.
+    """
+    if getattr(_perimeters, 'pid', None) != os.getpid():
+        _perimeters.pid = os.getpid()
+        _perimeters.prepared = {}
+
+    if name not in _perimeters.prepared:
+        perimeter = getattr(settings, name)
+        if isinstance(perimeter, dict):
+            perimeter = GEOSGeometry(json.dumps(perimeter['geometry']),
+                                     srid=4326)
+
+        _perimeters.prepared[name] = (perimeter.prepared, perimeter.extent)
+
+    return _perimeters.prepared[name]
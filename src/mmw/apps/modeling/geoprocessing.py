@@ -3,22 +3,43 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import hashlib
+import os
 import requests
 import json
+import time
 
 from ast import literal_eval as make_tuple
+from collections import OrderedDict
+from copy import deepcopy
+from functools import partial
 
 from celery import shared_task
-from celery.exceptions import Retry
+from celery.exceptions import MaxRetriesExceededError, Retry
 
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
+from requests.packages.urllib3.util.retry import Retry as HTTPRetry
 
 from django_statsd.clients import statsd
 
 from django.core.cache import cache
 from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
 
 NOWKAOI = 'nowkaoi'
+SHAPE_CACHE_PREFIX = 'shape_'
+LOCK_POLL_INTERVAL = 0.5
+LOCK_RETRY_DELAY = 1
+
+# Parsed result keys, see `parse_key`
+_parsed_keys = {}
+PARSED_KEYS_SIZE = 10000
+
+# Session for connecting to the geoprocessing service, and the id of the
+# process it was made in, so that forked worker processes make their own
+_session = None
+_session_pid = None
 
 
 @shared_task(bind=True, default_retry_delay=1, max_retries=6)
@@ -37,11 +58,21 @@ def run(self, opname, input_data, wkaoi=None, cache_key=''):
     If a well-known area of interest id is specified in wkaoi, checks to see
     if there is a cached result for that wkaoi and operation. If so, returns
     that immediately. If not, starts the geoprocessing operation, and saves the
-    results to they key before passing them on.
+    results to they key before passing them on. Without a wkaoi, results are
+    cached the same way for a limited time under a hash of the input polygons,
+    so that analyzing the same drawn shape again is also cached.
+
+    Cache keys end with the version of the operation, a fingerprint of its
+    rasters and type, so that changing those in settings.GEOP['json'] does
+    not return results cached for the old definition.
+
+    If another task is already running the same operation for the same shape,
+    waits for its result instead of running it again. See `single_flight`.
 
-    When using a parameterizable operation, such as 'ppt' or 'tmean', a special
-    cache_key can be provided which will be used for caching instead of the
-    opname, which in this case is not unique to the operation.
+    When using a parameterizable operation, whose input_data selects the
+    raster to use, a special cache_key can be provided which will be used for
+    caching instead of the opname, which in this case is not unique to the
+    operation.
 
     To be used for single operation requests. Uses the /run endpoint of the
     geoprocessing service.
@@ -62,29 +93,39 @@ def run(self, opname, input_data, wkaoi=None, cache_key=''):
             'error': 'Input data cannot be empty'
         }
 
-    key = ''
-
-    if wkaoi and settings.GEOP['cache']:
-        key = 'geop_{}__{}{}'.format(wkaoi, opname, cache_key)
-        cached = cache.get(key)
-        if cached:
-            return cached
-
-    data = settings.GEOP['json'][opname].copy()
+    data = deepcopy(settings.GEOP['json'][opname])
     data['input'].update(input_data)
 
+    key = ''
+    timeout = None
+
+    if settings.GEOP['cache']:
+        cache_id = wkaoi
+        if not cache_id and input_data.get('polygon'):
+            cache_id = safe_shape_cache_id(input_data['polygon'])
+
+        if cache_id:
+            key = result_cache_key(cache_id,
+                                   '{}{}'.format(opname, cache_key),
+                                   operation_version(data['input']))
+            timeout = result_cache_timeout(cache_id)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
     # If no vector data is supplied for vector operation, shortcut to empty
     if 'vector' in data['input'] and data['input']['vector'] == [None]:
         result = {}
         if key:
-            cache.set(key, result, None)
+            cache.set(key, result, timeout)
         return result
 
     try:
-        result = geoprocess('run', data, self.retry)
+        compute = partial(_run_and_cache, data, key, timeout)
         if key:
-            cache.set(key, result, None)
-        return result
+            return single_flight(key, partial(cache.get, key), compute,
+                                 self.retry)
+        return compute()
     except Retry as r:
         raise r
     except ConnectionError:
@@ -156,19 +197,25 @@ def multi(self, opname, shapes, stream_lines):
 
     Each `operation_results` is cached with the key:
 
-        {{ shape_id }}__{{ operation_label }}
+        {{ shape_id }}__{{ operation_label }}__{{ operation_version }}
+
+    or, for shapes with the id NOWKAOI, a key made from a hash of the shape
+    which expires after settings.GEOP['shape_cache_timeout'].
 
-    Before running the geoprocessing service, we inspect the cache to see
-    if all the requested operations are already cached for this shape. If so,
-    we remove that shape from the payload.
+    Before running the geoprocessing service, we fetch the cached results of
+    all requested operations for all shapes in one batch. If all operations
+    are cached for a shape, we remove that shape from the payload.
 
-    If not found in the cache, the specified operations are run for that shape
-    as part of the payload. Once we have the results back, we cache them. Since
-    we are using the same cache naming scheme as run, any operation cached via
-    `multi` can be reused by `run`.
+    Otherwise only the operations missing from the cache are run for that
+    shape. Shapes missing the same operations are sent together, one request
+    per distinct set of missing operations, which is usually a single request.
+    Once we have the results back, we cache them in one batch and merge them
+    with the cached ones. Since we are using the same cache naming scheme as
+    run, any operation cached via `multi` can be reused by `run`. Concurrent
+    requests for the same operations for the same shapes are coalesced with
+    `single_flight`.
     """
     data = settings.GEOP['json'][opname].copy()
-    data['shapes'] = []
 
     # Don't include the RasterLinesJoin operation if the AoI does
     # not contain streams
@@ -178,39 +225,56 @@ def multi(self, opname, shapes, stream_lines):
         data['operations'] = [o for o in data['operations']
                               if not (o.get('name') == 'RasterLinesJoin')]
 
-    operation_count = len(data['operations'])
+    versions = OrderedDict((op['label'], operation_version(op))
+                           for op in data['operations'])
     output = {}
 
-    # Get cached results
+    cache_ids = {}
     for shape in shapes:
-        cached_operations = 0
         if shape['id'] != NOWKAOI:
-            output[shape['id']] = {}
-            for op in data['operations']:
-                key = 'geop_{}__{}'.format(shape['id'], op['label'])
-                cached = cache.get(key)
-                if cached:
-                    output[shape['id']][op['label']] = cached
-                    cached_operations += 1
+            cache_ids[shape['id']] = shape['id']
+        elif settings.GEOP['cache']:
+            cache_id = safe_shape_cache_id([shape['shape']])
+            if cache_id:
+                cache_ids[shape['id']] = cache_id
+
+    # Get cached results
+    cached = get_cached_results(cache_ids.values(), versions)
 
-        if cached_operations != operation_count:
-            data['shapes'].append(shape)
+    # Group shapes by the operations missing from the cache for them
+    missing_shapes = OrderedDict()
+    for shape in shapes:
+        if shape['id'] in cache_ids:
+            output[shape['id']] = cached.get(cache_ids[shape['id']], {})
+
+        missing = tuple(label for label in versions
+                        if label not in output.get(shape['id'], {}))
+        if missing:
+            missing_shapes.setdefault(missing, []).append(shape)
 
     # If no un-cached shapes, return cached output
-    if not data['shapes']:
+    if not missing_shapes:
         return output
 
     try:
-        result = geoprocess('multi', data, self.retry)
-
-        # Set cached results
-        for shape_id, operation_results in result.iteritems():
-            if shape_id != NOWKAOI:
-                for op_label, value in operation_results.iteritems():
-                    key = 'geop_{}__{}'.format(shape_id, op_label)
-                    cache.set(key, value, None)
-
-        output.update(result)
+        for missing, group in missing_shapes.iteritems():
+            missing_versions = OrderedDict((label, versions[label])
+                                           for label in missing)
+            compute = partial(_multi_and_cache, data, group, cache_ids,
+                              missing_versions)
+            group_ids = [cache_ids[shape['id']] for shape in group
+                         if shape['id'] in cache_ids]
+
+            if len(group_ids) == len(group):
+                key = group_cache_key(group_ids, missing_versions)
+                fetch = partial(_get_cached_group, group, cache_ids,
+                                missing_versions)
+                result = single_flight(key, fetch, compute, self.retry)
+            else:
+                result = compute()
+
+            for shape_id, operation_results in result.iteritems():
+                output.setdefault(shape_id, {}).update(operation_results)
 
         return output
     except Retry as r:
@@ -225,8 +289,327 @@ def multi(self, opname, shapes, stream_lines):
         }
 
 
+def _run_and_cache(data, key, timeout):
+    result = geoprocess('run', data)
+    if key:
+        cache.set(key, result, timeout)
+    return result
+
+
+def _multi_and_cache(data, shapes, cache_ids, versions):
+    """
+    Runs the given operations for the given shapes with the multi endpoint,
+    and caches the results.
+    """
+    data = data.copy()
+    data['shapes'] = shapes
+    data['operations'] = [o for o in data['operations']
+                          if o['label'] in versions]
+
+    result = geoprocess('multi', data)
+
+    set_cached_results({
+        cache_ids[shape_id]: operation_results
+        for shape_id, operation_results in result.iteritems()
+        if shape_id in cache_ids
+    }, versions)
+
+    return result
+
+
+def _get_cached_group(shapes, cache_ids, versions):
+    """
+    Returns the cached results of the given operations for the given shapes,
+    keyed by shape id, if all are cached, or None otherwise.
+    """
+    cached = get_cached_results([cache_ids[s['id']] for s in shapes],
+                                versions)
+
+    if all(len(cached.get(cache_ids[s['id']], {})) == len(versions)
+           for s in shapes):
+        return {s['id']: cached[cache_ids[s['id']]] for s in shapes}
+
+    return None
+
+
+def single_flight(key, fetch, compute, retry=None):
+    """
+    Coalesces concurrent computations of the same result. The first caller
+    for a key takes a lock in the cache and returns compute(). Callers that
+    find the key locked instead return fetch(), if compute() has already
+    cached the result.
+
+    Otherwise, tasks are retried with retry every LOCK_RETRY_DELAY seconds,
+    rather than holding a worker while waiting, and other callers poll fetch()
+    every LOCK_POLL_INTERVAL seconds. If the result does not appear within
+    settings.GEOP['lock_wait'] seconds, the result is computed without the
+    lock, which is only ever released by its holder. Locks expire after
+    settings.GEOP['lock_timeout'] seconds, so if the task holding one dies,
+    another takes over.
+
+    :param key: String cache key of the result
+    :param fetch: Function that returns the cached result, or None
+    :param compute: Function that computes, caches and returns the result
+    :param retry: Retry method of the calling task. Optional.
+    :return: The result of compute or fetch
+    """
+    lock = 'lock_{}'.format(key)
+    lock_timeout = settings.GEOP['lock_timeout']
+    lock_wait = settings.GEOP['lock_wait']
+
+    # add returns None rather than False if the cache is unavailable, in
+    # which case we cannot coalesce and compute the result right away
+    if cache.add(lock, True, lock_timeout) is not False:
+        return _compute_locked(lock, compute)
+
+    result = fetch()
+    if result is not None:
+        statsd.incr(__name__ + '.single_flight.coalesced')
+        return result
+
+    if retry is not None:
+        try:
+            retry(countdown=LOCK_RETRY_DELAY,
+                  max_retries=int(lock_wait // LOCK_RETRY_DELAY))
+        except MaxRetriesExceededError:
+            pass
+    else:
+        deadline = time.time() + lock_wait
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+
+            result = fetch()
+            if result is not None:
+                statsd.incr(__name__ + '.single_flight.coalesced')
+                return result
+
+            # The lock holder finished without caching a result, or cached
+            # it just after it was fetched
+            if cache.add(lock, True, lock_timeout) is not False:
+                return _compute_locked(lock, partial(_fetch_or_compute,
+                                                     fetch, compute))
+
+    statsd.incr(__name__ + '.single_flight.timeout')
+    return compute()
+
+
+def _fetch_or_compute(fetch, compute):
+    result = fetch()
+    return result if result is not None else compute()
+
+
+def _compute_locked(lock, compute):
+    """
+    Returns compute(), releasing the given lock, held by the caller, after.
+    """
+    try:
+        return compute()
+    finally:
+        cache.delete(lock)
+
+
+def group_cache_key(shape_ids, versions):
+    """
+    Returns a key identifying the given operations for the given shapes, to
+    coalesce concurrent requests for them with.
+    """
+    keys = sorted(result_cache_key(shape_id, label, version)
+                  for shape_id in shape_ids
+                  for label, version in versions.iteritems())
+
+    return 'geop_group_{}'.format(hashlib.sha1(''.join(keys)).hexdigest())
+
+
+def result_cache_key(shape_id, label, version):
+    return 'geop_{}__{}__{}'.format(shape_id, label, version)
+
+
+def operation_version(operation):
+    """
+    Returns a fingerprint of what the given operation computes: its type and
+    rasters, and settings.GEOP['cache_version'], which can be changed to
+    invalidate results when raster data is updated in place. Accepts both
+    the 'input' of an operation for `run` and an operation for `multi`, which
+    give the same fingerprint if they compute the same thing.
+
+    :param operation: Dictionary defining an operation
+    :return: String of 8 hexadecimal digits
+    """
+    spec = [settings.GEOP['cache_version'],
+            operation.get('operationType', operation.get('name')),
+            operation.get('rasters', []),
+            operation.get('targetRaster'),
+            operation.get('pixelIsArea', False)]
+
+    return hashlib.sha1(json.dumps(spec)).hexdigest()[:8]
+
+
+def result_cache_timeout(shape_id):
+    """
+    Results for well-known areas of interest are cached indefinitely, and
+    those for other shapes for settings.GEOP['shape_cache_timeout'] seconds.
+    """
+    if shape_id.startswith(SHAPE_CACHE_PREFIX):
+        return settings.GEOP['shape_cache_timeout']
+    return None
+
+
+def shape_cache_id(polygons):
+    """
+    Returns an id to cache the results for the given polygons under, which is
+    the same for all equivalent polygons. The coordinates are rounded to
+    settings.GEOP['shape_cache_precision'] digits, and the rings and polygons
+    are put in a canonical order and orientation, before hashing the WKB of
+    each polygon.
+
+    :param polygons: List of GeoJSON Polygons or MultiPolygons, as strings
+                     or dictionaries
+    :return: String id of the form "shape_{hash}"
+    """
+    precision = settings.GEOP['shape_cache_precision']
+    digest = hashlib.sha1()
+
+    for polygon in polygons:
+        if not isinstance(polygon, dict):
+            polygon = json.loads(polygon)
+
+        if polygon['type'] == 'MultiPolygon':
+            polygon = {
+                'type': 'MultiPolygon',
+                'coordinates': sorted(_normalize_polygon(p, precision)
+                                      for p in polygon['coordinates'])
+            }
+        else:
+            polygon = {
+                'type': polygon['type'],
+                'coordinates': _normalize_polygon(polygon['coordinates'],
+                                                  precision)
+            }
+
+        digest.update(bytes(GEOSGeometry(json.dumps(polygon)).wkb))
+
+    return SHAPE_CACHE_PREFIX + digest.hexdigest()
+
+
+def safe_shape_cache_id(polygons):
+    """
+    Returns the `shape_cache_id` of the given polygons, or None if they can't
+    be normalized, like malformed GeoJSON or rings that collapse when rounded,
+    in which case their results are not cached. Any error with the polygons
+    themselves is left to the geoprocessing service to report.
+    """
+    try:
+        return shape_cache_id(polygons)
+    except Exception:
+        statsd.incr(__name__ + '.shape_cache_id.failed')
+        return None
+
+
+def _normalize_polygon(rings, precision):
+    """
+    Rounds the coordinates of the given polygon rings, orients the exterior
+    ring counterclockwise and holes clockwise, starts each ring at its lowest
+    point and sorts the holes.
+    """
+    normalized = []
+
+    for index, ring in enumerate(rings):
+        points = []
+        for x, y in (point[:2] for point in ring):
+            point = [round(x, precision), round(y, precision)]
+            if not points or points[-1] != point:
+                points.append(point)
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+
+        # Shoelace formula, positive for counterclockwise rings
+        area = sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2)
+                   in zip(points, points[1:] + points[:1]))
+        if (area > 0) != (index == 0):
+            points.reverse()
+
+        start = points.index(min(points))
+        points = points[start:] + points[:start]
+        normalized.append(points + points[:1])
+
+    return normalized[:1] + sorted(normalized[1:])
+
+
+@statsd.timer(__name__ + '.get_cached_results')
+def get_cached_results(shape_ids, versions):
+    """
+    Fetches the cached results of the given operations for the given shapes
+    in a single round trip to the cache.
+
+    :param shape_ids: List of well-known area of interest ids or shape cache
+                      ids
+    :param versions: Dictionary mapping operation labels to their versions
+    :return: Dictionary mapping shape ids to dictionaries mapping the labels
+             of their cached operations to results. Shapes with no cached
+             results are omitted.
+    """
+    keys = {result_cache_key(shape_id, label, version): (shape_id, label)
+            for shape_id in shape_ids
+            for label, version in versions.iteritems()}
+    output = {}
+
+    for key, value in cache.get_many(keys.keys()).iteritems():
+        if value:
+            shape_id, label = keys[key]
+            output.setdefault(shape_id, {})[label] = value
+
+    return output
+
+
+@statsd.timer(__name__ + '.set_cached_results')
+def set_cached_results(results, versions):
+    """
+    Caches the given operation results, in a single round trip to the cache
+    for each cache timeout they have.
+
+    :param results: Dictionary mapping well-known area of interest ids or
+                    shape cache ids to dictionaries mapping operation labels
+                    to results
+    :param versions: Dictionary mapping operation labels to their versions
+    """
+    values = {}
+    for shape_id, operation_results in results.iteritems():
+        timeout = result_cache_timeout(shape_id)
+        for label, value in operation_results.iteritems():
+            key = result_cache_key(shape_id, label, versions[label])
+            values.setdefault(timeout, {})[key] = value
+
+    for timeout, timeout_values in values.iteritems():
+        cache.set_many(timeout_values, timeout)
+
+
+def get_session():
+    """
+    Returns the session for connecting to the geoprocessing service, which
+    keeps up to settings.GEOP['pool_size'] connections alive for reuse, and
+    retries failed connections with exponential backoff. Each process has its
+    own, since connections cannot be shared with forked processes.
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        retries = HTTPRetry(total=settings.GEOP['connect_retries'],
+                            connect=settings.GEOP['connect_retries'],
+                            read=0,
+                            backoff_factor=settings.GEOP['retry_backoff'])
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=settings.GEOP['pool_size'],
+                              max_retries=retries)
+
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session_pid = os.getpid()
+
+    return _session
+
+
 @statsd.timer(__name__ + '.geop_run')
-def geoprocess(endpoint, data, retry=None):
+def geoprocess(endpoint, data):
     """
     Submit a request to the specified endpoint of the geoprocessing service.
     Returns its result.
@@ -236,17 +619,24 @@ def geoprocess(endpoint, data, retry=None):
 
     geop_url = 'http://{}:{}/{}'.format(host, port, endpoint)
 
+    session = get_session()
+    pool = session.get_adapter(geop_url).poolmanager \
+                  .connection_from_url(geop_url)
+    num_connections = pool.num_connections
+
     try:
-        response = requests.post(geop_url,
-                                 data=json.dumps(data),
-                                 headers={'Content-Type': 'application/json'},
-                                 timeout=settings.TASK_REQUEST_TIMEOUT)
-    except ConnectionError as exc:
-        if retry is not None:
-            retry(exc=exc)
-    except Timeout as exc:
+        response = session.post(geop_url,
+                                data=json.dumps(data),
+                                headers={'Content-Type': 'application/json'},
+                                timeout=settings.TASK_REQUEST_TIMEOUT)
+    except Timeout:
         raise Exception('Geoprocessing service timed out.')
 
+    if pool.num_connections == num_connections:
+        statsd.incr(__name__ + '.connection.reused')
+    else:
+        statsd.incr(__name__ + '.connection.new')
+
     if response.ok:
         result = response.json()
         if 'result' in result:
@@ -279,4 +669,38 @@ def parse(result):
     :param result: Dictionary mapping strings like 'List(a,b,c)' to ints
     :return: Dictionary mapping tuples of ints to ints
     """
-    return {make_tuple(key[4:]): val for key, val in result.items()}
+    return {parse_key(key): val for key, val in result.items()}
+
+
+def parse_key(key):
+    """
+    Converts a key of a raw JSON result like 'List(1,2)' to the tuple (1, 2),
+    or 'List(1)' to 1, the same as evaluating the part after 'List' would.
+
+    The same few hundred keys recur in every result, so parsed keys are
+    remembered, up to PARSED_KEYS_SIZE of them.
+
+    :param key: String like 'List(a,b,c)'
+    :return: Tuple of ints, or int if there is only one
+    """
+    try:
+        return _parsed_keys[key]
+    except KeyError:
+        pass
+
+    inner = key[5:-1]
+
+    try:
+        if not (key.startswith('List(') and key.endswith(')')):
+            raise ValueError(key)
+        values = tuple(int(v) for v in inner.split(',')) if inner else ()
+        parsed = values[0] if len(values) == 1 else values
+    except ValueError:
+        # Not a list of integers, so fall back to evaluating it
+        parsed = make_tuple(key[4:])
+
+    if len(_parsed_keys) >= PARSED_KEYS_SIZE:
+        _parsed_keys.clear()
+    _parsed_keys[key] = parsed
+
+    return parsed
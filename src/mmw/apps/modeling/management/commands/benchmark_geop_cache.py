@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from apps.modeling.calcs import split_into_huc12s
+from apps.modeling.geoprocessing import (get_cached_results,
+                                         operation_version,
+                                         result_cache_key)
+
+
+class Command(BaseCommand):
+    """
+    Time looking up the cached MapShed geoprocessing results of the HUC-12s
+    in a HUC-8, as subbasin modeling does, one key at a time and in a single
+    batch.
+    """
+
+    help = 'Benchmark geoprocessing cache lookups for a HUC-8'
+
+    def add_arguments(self, parser):
+        parser.add_argument('huc8_id', type=int,
+                            help='Id of the boundary_huc08 row to look up.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of times to repeat each lookup.')
+
+    def handle(self, *args, **options):
+        shape_ids = [wkaoi for (wkaoi, _, _)
+                     in split_into_huc12s('huc8', options['huc8_id'])]
+        versions = {op['label']: operation_version(op)
+                    for op in settings.GEOP['json']['mapshed']['operations']}
+        repeat = options['repeat']
+
+        self.stdout.write(
+            'Looking up {} operations for {} shapes, {} times'.format(
+                len(versions), len(shape_ids), repeat))
+
+        start = time.time()
+        for _ in range(repeat):
+            for shape_id in shape_ids:
+                for label, version in versions.iteritems():
+                    cache.get(result_cache_key(shape_id, label, version))
+        serial_secs = (time.time() - start) / repeat
+
+        start = time.time()
+        for _ in range(repeat):
+            cached = get_cached_results(shape_ids, versions)
+        batch_secs = (time.time() - start) / repeat
+
+        self.stdout.write('Cached:  {} of {} results'.format(
+            sum(len(results) for results in cached.values()),
+            len(shape_ids) * len(versions)))
+        self.stdout.write('Serial:  {:.1f} ms per lookup'.format(
+            serial_secs * 1000))
+        self.stdout.write('Batched: {:.1f} ms per lookup'.format(
+            batch_secs * 1000))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import time
+
+from ast import literal_eval
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.modeling.geoprocessing import parse_key
+
+
+class Command(BaseCommand):
+    """
+    Time parsing the keys of nlcd_soil results, with every combination of
+    NLCD and soil group, for a number of shapes, using literal_eval as parse
+    used to and parse_key.
+    """
+
+    help = 'Benchmark parsing geoprocessing result keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shapes', type=int, default=150,
+                            help='Number of shape results to parse.')
+
+    def handle(self, *args, **options):
+        soils = [settings.NODATA] + range(1, 8)
+        keys = ['List({},{})'.format(nlcd, soil)
+                for nlcd in settings.NLCD_MAPPING
+                for soil in soils]
+        shapes = options['shapes']
+
+        self.stdout.write('Parsing {} keys for {} shapes'.format(len(keys),
+                                                                 shapes))
+
+        start = time.time()
+        for _ in range(shapes):
+            for key in keys:
+                literal_eval(key[4:])
+        literal_eval_secs = time.time() - start
+
+        start = time.time()
+        for _ in range(shapes):
+            for key in keys:
+                parse_key(key)
+        parse_key_secs = time.time() - start
+
+        self.stdout.write('literal_eval: {:.1f} ms'.format(
+            literal_eval_secs * 1000))
+        self.stdout.write('parse_key:    {:.1f} ms'.format(
+            parse_key_secs * 1000))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.modeling.mapshed.calcs import weather_cubes
+from apps.modeling.mapshed.weather_store import write_weather_store
+
+
+class Command(BaseCommand):
+    """
+    Export the ms_weather table to a memory-mapped weather store, which
+    MapShed reads instead of the database when MMW_MAPSHED_WEATHER_STORE
+    points to it. Needs to be re-run whenever ms_weather is reloaded.
+    """
+
+    help = 'Export ms_weather to the MapShed weather store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path',
+                            default=settings.MAPSHED['weather_store'],
+                            help='Directory to export to. Defaults to '
+                                 'MMW_MAPSHED_WEATHER_STORE.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of stations to query at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('No path given and '
+                               'MMW_MAPSHED_WEATHER_STORE is not set')
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT station FROM ms_weather '
+                           'ORDER BY station')
+            stations = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT MIN(year), MAX(year) FROM ms_weather')
+            begyear, endyear = [int(year) for year in cursor.fetchone()]
+
+        self.stdout.write('Exporting {} stations from {} to {} into {}'.format(
+            len(stations), begyear, endyear, path))
+
+        write_weather_store(path, stations, begyear, endyear, weather_cubes,
+                            batch_size=options['batch_size'])
+
+        self.stdout.write('Done')
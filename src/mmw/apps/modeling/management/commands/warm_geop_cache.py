@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+import os
+import re
+
+from multiprocessing.pool import ThreadPool
+
+from celery.exceptions import Retry
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from rest_framework.exceptions import ValidationError
+
+from apps.modeling.calcs import _get_boundary_layer_by_code
+from apps.modeling.geoprocessing import multi, run
+from apps.modeling.mapshed.calcs import streams
+from apps.modeling.serializers import AoiSerializer
+
+WKAOI_KEY = re.compile(r'^geop_([a-z0-9]+__\d+)__')
+HUC_CODES = ['huc8', 'huc10', 'huc12']
+
+
+class Command(BaseCommand):
+    """
+    Fill the geoprocessing cache for the current version of each operation,
+    for the given well-known areas of interest, the HUCs of the given levels,
+    or all of those that already have cached results. Operations whose
+    results are already cached for their current version are skipped.
+
+    HUCs can be limited to a region by the prefix of their codes, eg. "02"
+    for the Mid-Atlantic. With --progress, the areas of interest warmed are
+    recorded in a file, and skipped if the command is run again.
+
+    The operations are run in this process rather than by the Celery workers,
+    so after changing the rasters or operations in settings.GEOP['json'], this
+    can be run with the new settings before they are deployed to the workers,
+    which keep using the old cached results until then.
+    """
+
+    help = 'Warm the geoprocessing cache for the current operation versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('wkaoi', nargs='*',
+                            help='Well-known areas of interest to warm, like '
+                                 '"huc12__55174". Defaults to all with '
+                                 'cached results.')
+        parser.add_argument('--huc', action='append', choices=HUC_CODES,
+                            help='Warm all HUCs of this level. May be '
+                                 'repeated.')
+        parser.add_argument('--region', default='',
+                            help='Only warm HUCs with codes starting with '
+                                 'this, eg. "0204".')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of shapes to send to the '
+                                 'geoprocessing service at a time.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of batches to warm at a time.')
+        parser.add_argument('--progress',
+                            help='File to record warmed areas of interest '
+                                 'in, and skip those already recorded.')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='List the areas of interest to warm '
+                                 'without warming them.')
+
+    def handle(self, *args, **options):
+        if options['region'] and not options['huc']:
+            raise CommandError('--region can only be used with --huc')
+
+        if options['huc']:
+            wkaois = options['wkaoi'] + self.huc_wkaois(options['huc'],
+                                                        options['region'])
+        else:
+            wkaois = options['wkaoi'] or self.cached_wkaois()
+
+        progress = options['progress']
+        if progress and os.path.exists(progress):
+            with open(progress) as f:
+                warmed = set(line.strip() for line in f)
+            wkaois = [wkaoi for wkaoi in wkaois if wkaoi not in warmed]
+
+        batch_size = options['batch_size']
+        batches = [wkaois[start:start + batch_size]
+                   for start in range(0, len(wkaois), batch_size)]
+
+        self.stdout.write('Warming {} areas of interest'.format(len(wkaois)))
+
+        if options['dry_run']:
+            for wkaoi in wkaois:
+                self.stdout.write(wkaoi)
+            return
+
+        pool = ThreadPool(options['workers'])
+        count = 0
+
+        try:
+            for batch, ok in pool.imap_unordered(self.warm, batches):
+                count += len(batch)
+                if progress and ok:
+                    with open(progress, 'a') as f:
+                        f.writelines(wkaoi + '\n' for wkaoi in batch)
+                self.stdout.write('Warmed {} of {}'.format(count,
+                                                           len(wkaois)))
+        finally:
+            pool.terminate()
+
+    def huc_wkaois(self, codes, region):
+        """
+        Returns the well-known areas of interest of the HUCs of the given
+        levels whose codes start with region.
+        """
+        wkaois = []
+
+        for code in codes:
+            table = _get_boundary_layer_by_code(code)['table_name']
+            sql = '''
+                  SELECT id
+                  FROM {table}
+                  WHERE {column} LIKE %s
+                  ORDER BY id
+                  '''.format(table=table, column=table.split('_')[1])
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [region + '%'])
+                wkaois.extend('{}__{}'.format(code, row[0])
+                              for row in cursor.fetchall())
+
+        return wkaois
+
+    def cached_wkaois(self):
+        """
+        Returns the well-known areas of interest with cached results of any
+        version.
+        """
+        wkaois = set()
+        for key in cache.iter_keys('geop_*'):
+            match = WKAOI_KEY.match(key)
+            if match:
+                wkaois.add(match.group(1))
+
+        return sorted(wkaois)
+
+    def warm(self, wkaois):
+        """
+        Warms the cache for the given areas of interest. Returns them, and
+        whether all their operations succeeded, reporting any error rather
+        than stopping the other batches. Runs in a worker thread, which uses
+        its own database connection.
+        """
+        try:
+            return wkaois, self.warm_shapes(wkaois)
+        except Retry:
+            # Another worker holds the lock for one of the operations
+            self.stdout.write('Skipping batch being computed elsewhere: '
+                              '{}'.format(', '.join(wkaois)))
+        except Exception as x:
+            self.stdout.write('Error warming {}: {}'.format(
+                ', '.join(wkaois), x))
+        finally:
+            connection.close()
+
+        return wkaois, False
+
+    def warm_shapes(self, wkaois):
+        shapes = []
+        for wkaoi in wkaois:
+            try:
+                serializer = AoiSerializer(data={'wkaoi': wkaoi})
+                serializer.is_valid(raise_exception=True)
+            except ValidationError:
+                self.stdout.write(
+                    'Skipping unknown area of interest {}'.format(wkaoi))
+                continue
+
+            shapes.append({'id': wkaoi,
+                           'shape': serializer.validated_data[
+                               'area_of_interest']})
+
+        if not shapes:
+            return True
+
+        # MapShed and climate operations, for all shapes at once, with the
+        # streams of all of them
+        geoms = [GEOSGeometry(shape['shape'], srid=4326) for shape in shapes]
+        stream_lines = streams(reduce(lambda a, b: a.union(b), geoms).json)[0]
+        ok = self.report(multi('mapshed', shapes, stream_lines))
+        ok = self.report(multi('climate', shapes, None)) and ok
+
+        # Analyze operations, one shape at a time
+        for shape in shapes:
+            for opname, input_data, cache_key in analyze_inputs(shape):
+                result = run(opname, input_data, shape['id'], cache_key)
+                ok = self.report(result) and ok
+
+        return ok
+
+    def report(self, result):
+        if 'error' in result:
+            self.stdout.write('Error: {}'.format(result['error']))
+            return False
+        return True
+
+
+def analyze_inputs(shape):
+    """
+    Yields the operation name, input data and cache key of each `run`
+    operation used to analyze the given shape.
+    """
+    aoi = shape['shape']
+
+    for opname in ['nlcd', 'soil', 'nlcd_soil', 'terrain']:
+        yield opname, {'polygon': [aoi]}, ''
+
+    yield 'nlcd_streams', {'polygon': [aoi], 'vector': streams(aoi)}, ''
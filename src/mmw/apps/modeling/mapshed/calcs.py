@@ -16,6 +16,9 @@ from django.db import connection
 
 from django.contrib.gis.geos import GEOSGeometry
 
+from apps.modeling.calcs import within_perimeter
+from apps.modeling.mapshed.weather_store import get_weather_store
+
 NRur = settings.GWLFE_DEFAULTS['NRur']
 NUM_WEATHER_STATIONS = settings.GWLFE_CONFIG['NumWeatherStations']
 KV_FACTOR = settings.GWLFE_CONFIG['KvFactor']
@@ -29,6 +32,10 @@ AG_NLCD_CODES = settings.GWLFE_CONFIG['AgriculturalNLCDCodes']
 KM_PER_M = 0.001
 CM_PER_INCH = 2.54
 CM_PER_M = 100.0
+ANIMALS = LIVESTOCK + POULTRY
+
+AgLSCP = namedtuple('Ag_LS_C_P',
+                    ['hp_ls', 'hp_c', 'hp_p', 'crop_ls', 'crop_c', 'crop_p'])
 
 
 def day_lengths(geom):
@@ -158,55 +165,106 @@ def kv_coefficient(area_pcts, season):
     return kv
 
 
-@statsd.timer(__name__ + '.animal_enery_units')
-def animal_energy_units(geom):
+@statsd.timer(__name__ + '.county_overlays')
+def county_overlays(geoms):
     """
-    Given a geometry, returns the total livestock and poultry AEUs within it
+    Given a list of geometries, clips the County Animals dataset to each of
+    them in a single query, and returns a list with one tuple per geometry:
+        ((livestock_aeu, poultry_aeu, population), ag_lscp)
+    as returned by `animal_energy_units` and `ag_ls_c_p` respectively.
+
+    Animal populations are weighted by the clipped fraction of each county,
+    while LS, C, and P factors are weighted by the clipped fraction of the
+    geometry.
 
     Original at Class1.vb@1.3.0:9230-9247
     """
+    if not geoms:
+        return []
+
     sql = '''
-          WITH clipped_counties AS (
-              SELECT ST_Intersection(geom,
-                                     ST_SetSRID(ST_GeomFromText(%s),
-                                                4326)) AS geom_clipped,
-                     ms_county_animals.*
-              FROM ms_county_animals
-              WHERE ST_Intersects(geom,
-                                  ST_SetSRID(ST_GeomFromText(%s),
-                                             4326))
+          WITH aois AS (
+              SELECT idx, ST_SetSRID(ST_GeomFromText(wkt), 4326) AS geom
+              FROM (VALUES {values}) AS aoi_wkts (idx, wkt)
+          ), clipped_counties AS (
+              SELECT aois.idx,
+                     ST_Area(ST_Intersection(c.geom, aois.geom)) AS clip_area,
+                     ST_Area(c.geom) AS county_area,
+                     ST_Area(aois.geom) AS aoi_area,
+                     c.ag_ha, c.beef_ha, c.broiler_ha, c.dairy_ha, c.goat_ha,
+                     c.sheep_ha, c.hog_ha, c.horse_ha, c.layer_ha,
+                     c.turkey_ha, c.hp_ls, c.hp_c, c.hp_p, c.crop_ls,
+                     c.crop_c, c.crop_p
+              FROM aois
+              JOIN ms_county_animals c ON ST_Intersects(c.geom, aois.geom)
           ), clipped_counties_with_area AS (
-              SELECT ST_Area(geom_clipped) / ST_Area(geom) AS clip_pct,
+              SELECT clip_area / county_area AS county_pct,
+                     clip_area / aoi_area AS clip_pct,
                      clipped_counties.*
               FROM clipped_counties
           )
-          SELECT COALESCE(SUM(beef_ha * ag_ha * clip_pct), 0.0) AS beef_cows,
-                 COALESCE(SUM(broiler_ha * ag_ha * clip_pct), 0.0) AS broilers,
-                 COALESCE(SUM(dairy_ha * ag_ha * clip_pct), 0.0) AS dairy_cows,
-                 COALESCE(SUM(goat_ha * ag_ha * clip_pct), 0.0) +
-                 COALESCE(SUM(sheep_ha * ag_ha * clip_pct), 0.0) AS sheep,
-                 COALESCE(SUM(hog_ha * ag_ha * clip_pct), 0.0) AS hogs,
-                 COALESCE(SUM(horse_ha * ag_ha * clip_pct), 0.0) AS horses,
-                 COALESCE(SUM(layer_ha * ag_ha * clip_pct), 0.0) AS layers,
-                 COALESCE(SUM(turkey_ha * ag_ha * clip_pct), 0.0) AS turkeys
-          FROM clipped_counties_with_area;
+          SELECT aois.idx,
+                 COALESCE(SUM(beef_ha * ag_ha * county_pct), 0.0)
+                     AS beef_cows,
+                 COALESCE(SUM(broiler_ha * ag_ha * county_pct), 0.0)
+                     AS broilers,
+                 COALESCE(SUM(dairy_ha * ag_ha * county_pct), 0.0)
+                     AS dairy_cows,
+                 COALESCE(SUM(goat_ha * ag_ha * county_pct), 0.0) +
+                 COALESCE(SUM(sheep_ha * ag_ha * county_pct), 0.0) AS sheep,
+                 COALESCE(SUM(hog_ha * ag_ha * county_pct), 0.0) AS hogs,
+                 COALESCE(SUM(horse_ha * ag_ha * county_pct), 0.0) AS horses,
+                 COALESCE(SUM(layer_ha * ag_ha * county_pct), 0.0) AS layers,
+                 COALESCE(SUM(turkey_ha * ag_ha * county_pct), 0.0)
+                     AS turkeys,
+                 COALESCE(SUM(hp_ls * clip_pct), 0.0) AS hp_ls,
+                 COALESCE(SUM(hp_c * clip_pct), 0.0) AS hp_c,
+                 COALESCE(SUM(hp_p * clip_pct), 0.0) AS hp_p,
+                 COALESCE(SUM(crop_ls * clip_pct), 0.0) AS crop_ls,
+                 COALESCE(SUM(crop_c * clip_pct), 0.0) AS crop_c,
+                 COALESCE(SUM(crop_p * clip_pct), 0.0) AS crop_p
+          FROM aois
+          LEFT JOIN clipped_counties_with_area USING (idx)
+          GROUP BY aois.idx
+          ORDER BY aois.idx;
           '''
 
+    values, params = [], []
+    for idx, geom in enumerate(geoms):
+        values.append('(%s, %s)')
+        params.extend([idx, geom.wkt])
+
     with connection.cursor() as cursor:
-        cursor.execute(sql, [geom.wkt, geom.wkt])
+        cursor.execute(sql.format(values=', '.join(values)), params)
 
-        # Convert result to dictionary
         columns = [col[0] for col in cursor.description]
-        values = cursor.fetchone()  # Only one row since aggregate query
-        population = dict(zip(columns, values))
-        livestock_aeu = round(sum(population[animal] *
-                                  WEIGHTOF[animal] / 1000
-                                  for animal in LIVESTOCK))
-        poultry_aeu = round(sum(population[animal] *
-                                WEIGHTOF[animal] / 1000
-                                for animal in POULTRY))
+        overlays = []
+        for row in cursor.fetchall():
+            # Convert result to dictionary
+            result = dict(zip(columns, row))
+            population = {animal: result[animal] for animal in ANIMALS}
+            livestock_aeu = round(sum(population[animal] *
+                                      WEIGHTOF[animal] / 1000
+                                      for animal in LIVESTOCK))
+            poultry_aeu = round(sum(population[animal] *
+                                    WEIGHTOF[animal] / 1000
+                                    for animal in POULTRY))
+            ag_lscp = AgLSCP(*[result[factor] for factor in AgLSCP._fields])
 
-        return livestock_aeu, poultry_aeu, population
+            overlays.append(((livestock_aeu, poultry_aeu, population),
+                             ag_lscp))
+
+        return overlays
+
+
+@statsd.timer(__name__ + '.animal_enery_units')
+def animal_energy_units(geom):
+    """
+    Given a geometry, returns the total livestock and poultry AEUs within it
+
+    Original at Class1.vb@1.3.0:9230-9247
+    """
+    return county_overlays([geom])[0][0]
 
 
 def manure_spread(aeu):
@@ -234,39 +292,7 @@ def ag_ls_c_p(geom):
     P factors for agriculatural land use tyeps within the geometry, namely
     Hay/Pasture and Cropland.
     """
-    sql = '''
-          WITH clipped_counties AS (
-              SELECT ST_Intersection(geom,
-                                     ST_SetSRID(ST_GeomFromText(%s),
-                                                4326)) AS geom_clipped,
-                     ms_county_animals.*
-              FROM ms_county_animals
-              WHERE ST_Intersects(geom,
-                                  ST_SetSRID(ST_GeomFromText(%s),
-                                             4326))
-          ), clipped_counties_with_area AS (
-              SELECT ST_Area(geom_clipped) /
-                     ST_Area(ST_SetSRID(ST_GeomFromText(%s),
-                                        4326)) AS clip_pct,
-                     clipped_counties.*
-              FROM clipped_counties
-          )
-          SELECT COALESCE(SUM(hp_ls * clip_pct), 0.0) AS hp_ls,
-                 COALESCE(SUM(hp_c * clip_pct), 0.0) AS hp_c,
-                 COALESCE(SUM(hp_p * clip_pct), 0.0) AS hp_p,
-                 COALESCE(SUM(crop_ls * clip_pct), 0.0) AS crop_ls,
-                 COALESCE(SUM(crop_c * clip_pct), 0.0) AS crop_c,
-                 COALESCE(SUM(crop_p * clip_pct), 0.0) AS crop_p
-          FROM clipped_counties_with_area;
-          '''
-
-    with connection.cursor() as cursor:
-        cursor.execute(sql, [geom.wkt, geom.wkt, geom.wkt])
-
-        ag_lscp = namedtuple('Ag_LS_C_P',
-                             [col[0] for col in cursor.description])
-
-        return ag_lscp(*(cursor.fetchone()))
+    return county_overlays([geom])[0][1]
 
 
 def ls_factors(lu_strms, total_strm_len, areas, avg_slope, ag_lscp):
@@ -337,6 +363,41 @@ def stream_length(geom, drb=False):
         return cursor.fetchone()[0] or 0  # Aggregate query returns singleton
 
 
+@statsd.timer(__name__ + '.stream_lengths')
+def stream_lengths(shapes, drb=False):
+    """
+    Given a list of shapes, finds the total length of streams in meters
+    within each of them, and returns a dictionary keyed by watershed id.
+    If the drb flag is set, we use the Delaware River Basin dataset instead
+    of NHD Flowline.
+    """
+    subquery = '''
+          (SELECT %s watershed_id,
+                  ROUND(SUM(ST_Length(
+                      ST_Transform(
+                          ST_Intersection(geom,
+                                          ST_SetSRID(ST_GeomFromText(%s),
+                                                     4326)),
+                          5070)))) AS stream_length
+          FROM {datasource}
+          WHERE ST_Intersects(geom,
+                              ST_SetSRID(ST_GeomFromText(%s), 4326)))
+          '''.format(datasource='drb_streams_50' if drb else 'nhdflowline')
+    subqueries, params = [], []
+    for (_, watershed_id, aoi) in shapes:
+        subqueries.append(subquery)
+        geom = GEOSGeometry(aoi, srid=4326)
+        params.extend([watershed_id, geom.wkt, geom.wkt])
+
+    sql = ' UNION ALL '.join(subqueries) + ';'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return {watershed_id: length or 0
+                for watershed_id, length in cursor.fetchall()}
+
+
 def streams(geojson, drb=False):
     """
     Given a GeoJSON, returns a list containing a single MultiLineString, that
@@ -384,12 +445,58 @@ def point_source_discharge(geom, area, drb=False):
         cursor.execute(sql, [geom.wkt])
         mg_d, kgn_month, kgp_month = cursor.fetchone()
 
-        n_load = [float(kgn_month)] * 12 if kgn_month else [0.0] * 12
-        p_load = [float(kgp_month)] * 12 if kgp_month else [0.0] * 12
-        discharge = [float(mg_d) * days * M3_PER_MGAL * CM_PER_M / area
-                     for days in MONTHDAYS] if mg_d else [0.0] * 12
+        return _point_source_loads(mg_d, kgn_month, kgp_month, area)
+
+
+@statsd.timer(__name__ + '.point_source_discharges')
+def point_source_discharges(shapes):
+    """
+    Given a list of shapes, returns a dictionary keyed by watershed id of
+    the Nitrogen Load, Phosphorus Load, and Discharge lists described in
+    `point_source_discharge` for each of them. Shapes within the Delaware
+    River Basin use the ms_pointsource_drb table.
+    """
+    subquery = '''
+          (SELECT %s watershed_id,
+                  SUM(mgd) AS mg_d,
+                  SUM(kgn_yr) / 12 AS kgn_month,
+                  SUM(kgp_yr) / 12 AS kgp_month
+          FROM {table_name}
+          WHERE ST_Intersects(geom,
+                              ST_SetSRID(ST_GeomFromText(%s), 4326)))
+          '''
+    subqueries, params, areas = [], [], {}
+    for (_, watershed_id, aoi) in shapes:
+        geom = GEOSGeometry(aoi, srid=4326)
+        table_name = get_point_source_table(
+            within_perimeter(geom, 'DRB_PERIMETER'))
+        subqueries.append(subquery.format(table_name=table_name))
+        params.extend([watershed_id, geom.wkt])
+        areas[watershed_id] = geom.transform(5070, clone=True).area
+
+    sql = ' UNION ALL '.join(subqueries) + ';'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return {watershed_id: _point_source_loads(mg_d, kgn_month, kgp_month,
+                                                  areas[watershed_id])
+                for watershed_id, mg_d, kgn_month, kgp_month
+                in cursor.fetchall()}
+
+
+def _point_source_loads(mg_d, kgn_month, kgp_month, area):
+    """
+    Given the total discharge in million gallons per day, the monthly
+    Nitrogen and Phosphorus loads in kg, and the area in square meters,
+    returns the monthly Nitrogen Load, Phosphorus Load, and Discharge lists.
+    """
+    n_load = [float(kgn_month)] * 12 if kgn_month else [0.0] * 12
+    p_load = [float(kgp_month)] * 12 if kgp_month else [0.0] * 12
+    discharge = [float(mg_d) * days * M3_PER_MGAL * CM_PER_M / area
+                 for days in MONTHDAYS] if mg_d else [0.0] * 12
 
-        return n_load, p_load, discharge
+    return n_load, p_load, discharge
 
 
 @statsd.timer(__name__ + '.weather_data')
@@ -403,11 +510,37 @@ def weather_data(ws, begyear, endyear):
     where `year` 0 corresponds to the first year in the range, 1 to the second,
     and so on; `month` 0 corresponds to January, 1 to February, and so on;
     `day` 0 corresponds to the 1st of the month, 1 to the 2nd, and so on.
+
+    If a weather store has been exported (see `export_weather_store`) and
+    covers the given stations and years, it is read instead of the database.
+    """
+    stations = tuple([w.station for w in ws])
+
+    store = get_weather_store()
+    if store and store.covers(stations, begyear, endyear):
+        temps, prcps = store.read(stations, begyear, endyear)
+    else:
+        temps, prcps = weather_cubes(stations, begyear, endyear)
+
+    return ({station_id: temps[i] for i, station_id in enumerate(stations)},
+            {station_id: prcps[i] for i, station_id in enumerate(stations)})
+
+
+def weather_cubes(stations, begyear, endyear):
+    """
+    Given a tuple of Weather Station ids and beginning and end years, queries
+    `ms_weather` and returns two NumPy arrays shaped (stations, years, 12, 31),
+    one for average temperature in Celsius and the other for precipitation
+    in centimeters. Stations are in the order given.
     """
     # Utility function to convert Fahrenheit to Celsius
     def f_to_c(f):
         return (f - 32) * 5.0 / 9.0
 
+    # Utility function to convert inches to centimeters
+    def in_to_cm(i):
+        return i * CM_PER_INCH
+
     temp_sql = '''
                SELECT station, year,
                    EXTRACT(MONTH FROM TO_DATE(month, 'MON')) AS month,
@@ -436,42 +569,58 @@ def weather_data(ws, begyear, endyear):
                '''
 
     year_range = endyear - begyear + 1
-    stations = tuple([w.station for w in ws])
-    # For each station id, create a 3D array of 0s
-    # where each 0 is a placeholder for a temperature/precipitation
-    # value on a given year, month, day: array[year][month][day] = 0
-    temps = {station_id: [[[0] * 31 for m in range(12)]
-                          for y in range(year_range)]
-             for station_id in stations}
-    prcps = {station_id: [[[0] * 31 for m in range(12)]
-                          for y in range(year_range)]
-             for station_id in stations}
+
     # Query the DB for daily temperatures for each weather station
     with connection.cursor() as cursor:
         cursor.execute(temp_sql, [stations, begyear, endyear])
-        for row in cursor.fetchall():
-            station = int(row[0])
-            year = int(row[1]) - begyear
-            month = int(row[2]) - 1
-            for day in range(31):
-                temps[station][year][month][day] = f_to_c(float(row[day + 3]))
+        temps = weather_cube(cursor.fetchall(), stations,
+                             begyear, year_range, f_to_c)
     # Query the DB for daily precipitation values for each weather station
     with connection.cursor() as cursor:
         cursor.execute(prcp_sql, [stations, begyear, endyear])
-        for row in cursor.fetchall():
-            station = int(row[0])
-            year = int(row[1]) - begyear
-            month = int(row[2]) - 1
-            for day in range(31):
-                prcp = float(row[day + 3]) * CM_PER_INCH
-                prcps[station][year][month][day] = prcp
+        prcps = weather_cube(cursor.fetchall(), stations,
+                             begyear, year_range, in_to_cm)
 
     return temps, prcps
 
 
+def weather_cube(rows, stations, begyear, year_range, convert):
+    """
+    Given `ms_weather` rows of (station, year, month, day 1, ..., day 31),
+    a tuple of station ids, the beginning year, the number of years and a
+    unit conversion function, returns a NumPy array shaped
+    (stations, years, 12, 31) with each row's converted daily values placed
+    at its station, year and month. Months without rows are left as 0.
+
+    If a station, year and month appears in more than one row, the last
+    one wins, as it did when the values were filled in row by row.
+    """
+    cube = numpy.zeros((len(stations), year_range, 12, 31))
+    if not rows:
+        return cube
+
+    data = numpy.array(rows, dtype=float)
+    order = numpy.argsort(stations)
+    sorted_stations = numpy.array(stations)[order]
+    station_idx = order[numpy.searchsorted(sorted_stations,
+                                           data[:, 0].astype(int))]
+    year_idx = data[:, 1].astype(int) - begyear
+    month_idx = data[:, 2].astype(int) - 1
+
+    # Keep only the last row for every (station, year, month)
+    flat_idx = numpy.ravel_multi_index((station_idx, year_idx, month_idx),
+                                       cube.shape[:3])
+    _, last = numpy.unique(flat_idx[::-1], return_index=True)
+    keep = len(flat_idx) - 1 - last
+
+    cube[station_idx[keep], year_idx[keep], month_idx[keep]] = \
+        convert(data[keep, 3:])
+
+    return cube
+
+
 def average_weather_data(wd):
-    A = numpy.array(wd)
-    return numpy.mean(A, axis=0).tolist()
+    return numpy.mean(numpy.asarray(wd), axis=0).tolist()
 
 
 def curve_number(n_count, ng_count):
@@ -9,6 +9,7 @@ from django.conf import settings
 from django_statsd.clients import statsd
 from django.contrib.gis.geos import GEOSGeometry
 
+from apps.modeling.calcs import within_perimeter
 from apps.modeling.geoprocessing import NOWKAOI, multi, run, parse
 from apps.modeling.mapshed.calcs import (day_lengths,
                                          nearest_weather_stations,
@@ -16,14 +17,15 @@ from apps.modeling.mapshed.calcs import (day_lengths,
                                          erosion_coeff,
                                          et_adjustment,
                                          kv_coefficient,
-                                         animal_energy_units,
-                                         ag_ls_c_p,
+                                         county_overlays,
                                          ls_factors,
                                          p_factors,
                                          manure_spread,
                                          streams,
                                          stream_length,
+                                         stream_lengths,
                                          point_source_discharge,
+                                         point_source_discharges,
                                          weather_data,
                                          average_weather_data,
                                          curve_number,
@@ -39,7 +41,6 @@ from apps.modeling.mapshed.calcs import (day_lengths,
 NLU = settings.GWLFE_CONFIG['NLU']
 NRur = settings.GWLFE_DEFAULTS['NRur']
 AG_NLCD_CODES = settings.GWLFE_CONFIG['AgriculturalNLCDCodes']
-DRB = settings.DRB_PERIMETER
 ANIMAL_KEYS = settings.GWLFE_CONFIG['AnimalKeys']
 ACRES_PER_SQM = 0.000247105
 HECTARES_PER_SQM = 0.0001
@@ -48,7 +49,8 @@ NO_LAND_COVER = 'NO_LAND_COVER'
 
 
 @shared_task
-def collect_data(geop_results, geojson, watershed_id=None, weather=None):
+def collect_data(geop_results, geojson, watershed_id=None, weather=None,
+                 county=None, stream_len=None, point_source=None):
     geop_result = {k: v for r in geop_results for k, v in r.items()}
 
     geom = GEOSGeometry(geojson, srid=4326)
@@ -76,11 +78,13 @@ def collect_data(geop_results, geojson, watershed_id=None, weather=None):
     z['WxYrs'] = z['WxYrEnd'] - z['WxYrBeg'] + 1
 
     # Data from the County Animals dataset
-    ag_lscp = ag_ls_c_p(geom)
+    if county is None:
+        [county] = county_overlays([geom])
+    (livestock_aeu, poultry_aeu, population), ag_lscp = county
+
     z['C'][0] = ag_lscp.hp_c
     z['C'][1] = ag_lscp.crop_c
 
-    livestock_aeu, poultry_aeu, population = animal_energy_units(geom)
     z['AEU'] = livestock_aeu / (area * ACRES_PER_SQM)
     z['n41j'] = livestock_aeu
     z['n41k'] = poultry_aeu
@@ -91,12 +95,16 @@ def collect_data(geop_results, geojson, watershed_id=None, weather=None):
     z['ManNitr'], z['ManPhos'] = manure_spread(z['AEU'])
 
     # Data from Streams dataset
-    z['StreamLength'] = stream_length(geom) or 10   # Meters
+    if stream_len is None:
+        stream_len = stream_length(geom)
+    z['StreamLength'] = stream_len or 10            # Meters
     z['n42b'] = round(z['StreamLength'] / 1000, 1)  # Kilometers
 
     # Data from Point Source Discharge dataset
-    n_load, p_load, discharge = point_source_discharge(geom, area,
-                                                       drb=geom.within(DRB))
+    if point_source is None:
+        point_source = point_source_discharge(
+            geom, area, drb=within_perimeter(geom, 'DRB_PERIMETER'))
+    n_load, p_load, discharge = point_source
     z['PointNitr'] = n_load
     z['PointPhos'] = p_load
     z['PointFlow'] = discharge
@@ -571,11 +579,20 @@ def collect_subbasin(payload, shapes):
         prcps_by_station = [unique_wd[1][station] for station in stations]
         return (ws, (average_weather_data(temps_by_station),
                      average_weather_data(prcps_by_station)))
+    # Clip the County Animals dataset to all huc-12s at once
+    counties = county_overlays([GEOSGeometry(aoi, srid=4326)
+                                for (_, _, aoi) in shapes])
+    # Query streams and point sources for all huc-12s at once
+    huc12_stream_lengths = stream_lengths(shapes)
+    huc12_point_sources = point_source_discharges(shapes)
+
     # Build the GMS data for each huc-12
     return [
         collect_data(convert_data(payload, wkaoi), aoi, watershed_id,
-                     get_weather(watershed_id))
-        for (wkaoi, watershed_id, aoi) in shapes
+                     get_weather(watershed_id), county,
+                     huc12_stream_lengths[watershed_id],
+                     huc12_point_sources[watershed_id])
+        for (wkaoi, watershed_id, aoi), county in zip(shapes, counties)
     ]
 
 
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import json
+import os
+
+import numpy
+
+from django.conf import settings
+
+MANIFEST = 'manifest.json'
+TEMP_CUBE = 'temp.npy'
+PRCP_CUBE = 'prcp.npy'
+
+# Stores opened by this process, keyed by path, along with the
+# modification time of the manifest they were opened from
+_stores = {}
+
+
+class WeatherStore(object):
+    """
+    A precomputed export of `ms_weather`, made of two arrays shaped
+    (stations, years, 12, 31) holding average temperature in Celsius and
+    precipitation in centimeters, in the same units and layout as
+    `weather_cubes`. The arrays are memory-mapped, so only the slices
+    that are read are paged in from disk.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+
+        self.begyear = manifest['begyear']
+        self.endyear = manifest['endyear']
+        self.index = {station: i
+                      for i, station in enumerate(manifest['stations'])}
+
+        self.temps = numpy.load(os.path.join(path, TEMP_CUBE), mmap_mode='r')
+        self.prcps = numpy.load(os.path.join(path, PRCP_CUBE), mmap_mode='r')
+
+    def covers(self, stations, begyear, endyear):
+        return (self.begyear <= begyear and endyear <= self.endyear and
+                all(station in self.index for station in stations))
+
+    def read(self, stations, begyear, endyear):
+        """
+        Returns the temperature and precipitation arrays for the given
+        stations and years, shaped (stations, years, 12, 31).
+        """
+        rows = [self.index[station] for station in stations]
+        years = slice(begyear - self.begyear, endyear - self.begyear + 1)
+
+        return (numpy.array(self.temps[rows, years]),
+                numpy.array(self.prcps[rows, years]))
+
+
+def write_weather_store(path, stations, begyear, endyear, cubes,
+                        batch_size=100):
+    """
+    Exports weather for the given stations and years to `path`, getting it
+    in batches of `batch_size` stations from `cubes(stations, begyear,
+    endyear)`. The manifest is written last, so a partial export is never
+    picked up by `get_weather_store`.
+    """
+    from numpy.lib.format import open_memmap
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    # Write to temporary files and move them into place when done, so that
+    # processes which have the previous export mapped are not disturbed
+    shape = (len(stations), endyear - begyear + 1, 12, 31)
+    temps_path = os.path.join(path, TEMP_CUBE + '.partial')
+    prcps_path = os.path.join(path, PRCP_CUBE + '.partial')
+    temps = open_memmap(temps_path, mode='w+',
+                        dtype=numpy.float64, shape=shape)
+    prcps = open_memmap(prcps_path, mode='w+',
+                        dtype=numpy.float64, shape=shape)
+
+    for start in range(0, len(stations), batch_size):
+        batch = tuple(stations[start:start + batch_size])
+        batch_temps, batch_prcps = cubes(batch, begyear, endyear)
+        temps[start:start + len(batch)] = batch_temps
+        prcps[start:start + len(batch)] = batch_prcps
+
+    temps.flush()
+    prcps.flush()
+    del temps, prcps
+
+    os.rename(temps_path, os.path.join(path, TEMP_CUBE))
+    os.rename(prcps_path, os.path.join(path, PRCP_CUBE))
+
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'begyear': begyear,
+            'endyear': endyear,
+            'stations': list(stations),
+        }, f)
+
+
+def get_weather_store():
+    """
+    Returns the WeatherStore at `settings.MAPSHED['weather_store']`, or None
+    if it is not configured or has not been exported yet. Stores are opened
+    once per process, and re-opened when the export is replaced.
+    """
+    path = settings.MAPSHED['weather_store']
+    if not path:
+        return None
+
+    try:
+        mtime = os.path.getmtime(os.path.join(path, MANIFEST))
+    except OSError:
+        return None
+
+    if path not in _stores or _stores[path][0] != mtime:
+        _stores[path] = (mtime, WeatherStore(path))
+
+    return _stores[path][1]
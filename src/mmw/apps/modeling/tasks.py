@@ -7,10 +7,11 @@ import logging
 import requests
 import json
 
-from ast import literal_eval as make_tuple
+from collections import OrderedDict
 from requests.exceptions import ConnectionError, Timeout
 from StringIO import StringIO
 
+from billiard import Pool
 from celery import shared_task
 
 from django_statsd.clients import statsd
@@ -18,6 +19,7 @@ from django.conf import settings
 
 from apps.core.models import Job
 from apps.modeling.calcs import apply_subbasin_gwlfe_modifications
+from apps.modeling.geoprocessing import parse_key
 from apps.modeling.tr55.utils import (aoi_resolution,
                                       precipitation,
                                       apply_modifications_to_census,
@@ -31,6 +33,11 @@ logger = logging.getLogger(__name__)
 KG_PER_POUND = 0.453592
 CM_PER_INCH = 2.54
 
+# JSON results of the most recently used MapShed jobs in this worker
+# process, keyed by job uuid, least recently used first. Completed jobs do
+# not change, so entries never go stale.
+_mapshed_results = OrderedDict()
+
 
 def format_quality(model_output):
     measures = ['Total Suspended Solids',
@@ -212,7 +219,7 @@ def nlcd_soil(result):
 
     for key, count in result.iteritems():
         # Extract (3, 4) from "List(3,4)"
-        (n, s) = make_tuple(key[4:])
+        (n, s) = parse_key(key)
         # Map [NODATA, ad, bd] to c, [cd] to d
         s2 = 3 if s in [settings.NODATA, 5, 6] else 4 if s == 7 else s
         # Only count those values for which we have mappings
@@ -332,19 +339,9 @@ def run_tr55(censuses, aoi, model_input, cached_aoi_census=None):
 def run_gwlfe(model_input, inputmod_hash, watershed_id=None):
     """
     Given a model_input resulting from a MapShed run, converts that dictionary
-    to an intermediate GMS file representation, which is then parsed by GWLF-E
-    to create the final data model z. We run GWLF-E on this final data model
-    and return the results.
-
-    This intermediate GMS file representation needs to be created because most
-    of GWLF-E logic is written to handle GMS files, and to support dictionaries
-    directly we would have to replicate all that logic. Thus, it is easier to
-    simply create a GMS file and have it read that.
+    to the final data model z, which we run GWLF-E on and return the results.
     """
-    output = to_gms_file(model_input)
-
-    reader = Parser.GmsReader(output)
-    z = reader.read()
+    z = to_data_model(model_input)
 
     result, _ = gwlfe.run(z)
     result['inputmod_hash'] = inputmod_hash
@@ -358,18 +355,45 @@ def run_gwlfe(model_input, inputmod_hash, watershed_id=None):
 def run_subbasin_gwlfe_chunks(mapshed_job_uuid, modifications,
                               total_stream_lengths, inputmod_hash,
                               watershed_ids):
-    mapshed_job = Job.objects.get(uuid=mapshed_job_uuid)
-    model_input = json.loads(mapshed_job.result)
-
-    return [
-        run_gwlfe(apply_subbasin_gwlfe_modifications(model_input[watershed_id],
-                                                     modifications,
-                                                     total_stream_lengths),
-                  inputmod_hash,
-                  watershed_id)
+    """
+    Runs GWLF-E for each of the given sub-basins of a MapShed job. If
+    `settings.GWLFE_SUBBASIN['pool_size']` is greater than 1, the runs are
+    spread across a pool of that many processes.
+    """
+    model_input = get_mapshed_result(mapshed_job_uuid)
+
+    gwlfe_args = [
+        (apply_subbasin_gwlfe_modifications(model_input[watershed_id],
+                                            modifications,
+                                            total_stream_lengths),
+         inputmod_hash,
+         watershed_id)
         for watershed_id in watershed_ids
     ]
 
+    pool_size = min(settings.GWLFE_SUBBASIN['pool_size'], len(gwlfe_args))
+    if pool_size <= 1:
+        return [run_gwlfe(*args) for args in gwlfe_args]
+
+    # Celery's billiard, unlike multiprocessing, allows pools to be
+    # started from within daemonic worker processes
+    pool = Pool(pool_size)
+    try:
+        results = pool.map(_run_gwlfe_args, gwlfe_args)
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def _run_gwlfe_args(args):
+    # Pool workers need a picklable, module level function to call
+    return run_gwlfe(*args)
+
 
 @shared_task
 @statsd.timer(__name__ + '.run_srat')
@@ -401,8 +425,7 @@ def run_srat(watersheds, mapshed_job_uuid):
         raise Exception('SRAT Catchment API did not return JSON')
 
     try:
-        mapshed_job = Job.objects.get(uuid=mapshed_job_uuid)
-        gmss = json.loads(mapshed_job.result)
+        gmss = get_mapshed_result(mapshed_job_uuid)
         result = format_subbasin(watersheds, srat_catchment_result, gmss)
     except KeyError as e:
         raise Exception('SRAT Catchment API returned malformed result: %s' % e)
@@ -410,6 +433,33 @@ def run_srat(watersheds, mapshed_job_uuid):
     return result
 
 
+def get_mapshed_result(mapshed_job_uuid):
+    """
+    Returns the parsed result of the given MapShed job. The sub-basin GWLF-E
+    chunks and SRAT tasks of a run all need the same, often multi-megabyte,
+    result, so the most recently used ones are kept in a worker-local cache
+    of `settings.GWLFE_SUBBASIN['result_cache_size']` entries instead of
+    being fetched and decompressed by each task. The JSON is parsed for each
+    call, so that callers get their own copy to modify.
+    """
+    key = str(mapshed_job_uuid)
+
+    try:
+        result_json = _mapshed_results.pop(key)
+        statsd.incr(__name__ + '.mapshed_result_cache.hit')
+    except KeyError:
+        statsd.incr(__name__ + '.mapshed_result_cache.miss')
+        mapshed_job = Job.objects.get(uuid=mapshed_job_uuid)
+        result_json = mapshed_job.get_result_json()
+
+    _mapshed_results[key] = result_json
+    while len(_mapshed_results) > \
+            settings.GWLFE_SUBBASIN['result_cache_size']:
+        _mapshed_results.popitem(last=False)
+
+    return json.loads(result_json)
+
+
 @shared_task
 def subbasin_results_to_dict(subbasin_results):
     def popped_key_result(result):
@@ -427,10 +477,7 @@ def to_gms_file(mapshed_data):
     """
     Given a dictionary of MapShed data, uses GWLF-E to convert it to a GMS file
     """
-    mapshed_areas = [round(a, 1) for a in mapshed_data['Area']]
-    mapshed_data['Area'] = mapshed_areas
-
-    pre_z = Parser.DataModel(mapshed_data)
+    pre_z = to_pre_data_model(mapshed_data)
     output = StringIO()
     writer = Parser.GmsWriter(output)
     writer.write(pre_z)
@@ -438,3 +485,95 @@ def to_gms_file(mapshed_data):
     output.seek(0)
 
     return output
+
+
+def to_data_model(mapshed_data):
+    """
+    Given a dictionary of MapShed data, returns the final GWLF-E data model z.
+
+    Most of GWLF-E's logic for deriving the data model is written to handle
+    GMS files, so rather than replicate it we have GWLF-E write the MapShed
+    data as GMS rows and read them back. The rows are handed from writer to
+    reader directly instead of being formatted to and parsed from GMS text,
+    which gives the same data model as reading the output of `to_gms_file`.
+    """
+    pre_z = to_pre_data_model(mapshed_data)
+    writer = GmsRowWriter()
+    writer.write(pre_z)
+
+    reader = GmsRowReader(writer.rows)
+
+    return reader.read()
+
+
+def to_pre_data_model(mapshed_data):
+    """
+    Given a dictionary of MapShed data, returns the GWLF-E data model to be
+    written as GMS. Areas are rounded to one decimal place, as they appear in
+    the GMS files MapShed produces.
+    """
+    mapshed_areas = [round(a, 1) for a in mapshed_data['Area']]
+    mapshed_data['Area'] = mapshed_areas
+
+    return Parser.DataModel(mapshed_data)
+
+
+def to_gms_value(value):
+    """
+    Given a value written by GmsWriter, returns it as it appears in a GMS file
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class GmsRowWriter(Parser.GmsWriter):
+    """
+    A GmsWriter that collects the rows of values it would write to a GMS file
+    """
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append([self.serialize_value(col) for col in row])
+
+
+class GmsRowReader(Parser.GmsReader):
+    """
+    A GmsReader of the rows collected by a GmsRowWriter. Numeric values are
+    read directly. All other values are converted to their GMS text first,
+    so they are parsed exactly as if read from a file.
+    """
+    def __init__(self, rows):
+        self.fp = self.iterate_row_values(rows)
+
+    @staticmethod
+    def iterate_row_values(rows):
+        for line_no, row in enumerate(rows, start=1):
+            for col_no, value in enumerate(row, start=1):
+                yield value, line_no, col_no
+            yield Parser.EOL, line_no, len(row) + 1
+
+    def next(self, typ):
+        value, line_no, col_no = self.fp.next()
+
+        if not callable(typ):
+            if typ != value:
+                raise ValueError('Expected "{}" but got "{}" at Line {} '
+                                 'Column {}'.format(typ, value,
+                                                    line_no, col_no))
+            return value
+
+        is_number = (isinstance(value, (int, long, float)) and
+                     not isinstance(value, bool))
+        if typ is float and is_number:
+            return float(value)
+        if typ is int and is_number and not isinstance(value, float):
+            return int(value)
+
+        try:
+            return typ(to_gms_value(value))
+        except ValueError:
+            logger.error('Unexpected token at Line {} Column {}'.format(
+                line_no, col_no))
+            raise
@@ -3,17 +3,45 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import json
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from ast import literal_eval
+from StringIO import StringIO
+from collections import OrderedDict
+from decimal import Decimal
+
+import numpy
+
 from celery import chain, shared_task
+from celery.exceptions import MaxRetriesExceededError, Retry
+from gwlfe import Parser
+from gwlfe.enums import GrowFlag
 
 from rest_framework.test import APIClient
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils.timezone import now
 
+from apps.core import notifications
 from apps.core.models import Job
-from apps.modeling import tasks, views
+from apps.modeling import calcs, geoprocessing, tasks, views
+from apps.modeling.management.commands import warm_geop_cache
+from apps.modeling.mapshed.calcs import county_overlays, weather_cube
+from apps.modeling.mapshed.weather_store import (get_weather_store,
+                                                 write_weather_store)
 
 
 @shared_task
@@ -890,3 +918,817 @@ class APIAccessTestCase(TestCase):
         scenario_id = str(response.data['id'])
 
         return scenario_id
+
+
+class WeatherStoreTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def fake_weather_cubes(self, stations, begyear, endyear):
+        # Encode the station and year in each value so slices can be checked
+        shape = (len(stations), endyear - begyear + 1, 12, 31)
+        temps = numpy.zeros(shape)
+        for i, station in enumerate(stations):
+            for y in range(shape[1]):
+                temps[i, y] = station * 10000 + begyear + y
+        return temps, -temps
+
+    def test_weather_store_round_trip(self):
+        stations = [11, 22, 33, 44, 55]
+        write_weather_store(self.path, stations, 1961, 1990,
+                            self.fake_weather_cubes, batch_size=2)
+
+        with override_settings(MAPSHED={'weather_store': self.path}):
+            store = get_weather_store()
+
+        self.assertTrue(store.covers((44, 11), 1970, 1990))
+        self.assertFalse(store.covers((44, 66), 1970, 1990))
+        self.assertFalse(store.covers((44, 11), 1960, 1990))
+
+        temps, prcps = store.read((44, 11), 1970, 1975)
+        expected, _ = self.fake_weather_cubes((44, 11), 1970, 1975)
+
+        self.assertEqual(temps.tolist(), expected.tolist())
+        self.assertEqual(prcps.tolist(), (-expected).tolist())
+
+    def test_weather_store_not_configured(self):
+        with override_settings(MAPSHED={'weather_store': None}):
+            self.assertIsNone(get_weather_store())
+
+        with override_settings(MAPSHED={'weather_store': self.path}):
+            self.assertIsNone(get_weather_store())
+
+
+class GwlfeDataModelTestCase(TestCase):
+    def mapshed_data(self):
+        """
+        Returns MapShed data for a made up area of interest with two years
+        of weather, in the shape produced by `collect_data`
+        """
+        rand = numpy.random.RandomState(0)
+        nlu = settings.GWLFE_CONFIG['NLU']
+        wxyrs = 2
+
+        z = settings.GWLFE_DEFAULTS.copy()
+        z.update({
+            'WxYrBeg': 1961,
+            'WxYrEnd': 1961 + wxyrs - 1,
+            'WxYrs': wxyrs,
+            'Temp': (rand.rand(wxyrs, 12, 31) * 30 - 5).tolist(),
+            'Prec': (rand.rand(wxyrs, 12, 31) * 2).tolist(),
+            'Grow': ([GrowFlag.NON_GROWING_SEASON] * 4 +
+                     [GrowFlag.GROWING_SEASON] * 6 +
+                     [GrowFlag.NON_GROWING_SEASON] * 2),
+            'Area': (rand.rand(nlu) * 1000).tolist(),
+            'NumNormalSys': [int(n) for n in rand.randint(0, 100, 12)],
+        })
+        for key in ['Acoef', 'DayHrs', 'KV', 'PcntET',
+                    'PointFlow', 'PointNitr', 'PointPhos']:
+            z[key] = rand.rand(12).tolist()
+        for key in ['CN', 'KF', 'LS', 'P', 'PhosConc']:
+            z[key] = rand.rand(nlu).tolist()
+        for key in ['ManNitr', 'ManPhos']:
+            z[key] = rand.rand(2).tolist()
+        for key in ['AEU', 'AgLength', 'AgSlope3', 'AgSlope3To8', 'AvKF',
+                    'AvSlope', 'GrNitrConc', 'GrPhosConc', 'MaxWaterCap',
+                    'RecessionCoef', 'SedAFactor', 'SedDelivRatio',
+                    'SedNitr', 'SedPhos', 'StreamLength', 'TotArea',
+                    'UrbAreaTotal', 'UrbLength', 'n23', 'n23b', 'n24',
+                    'n24b', 'n41', 'n41j', 'n41k', 'n41l', 'n42', 'n42b',
+                    'n46e', 'n46f']:
+            z[key] = rand.rand() * 100
+
+        return z
+
+    def test_data_model_matches_gms_round_trip(self):
+        """
+        Building the data model directly should give the same result as
+        writing and parsing a GMS file
+        """
+        gms_z = Parser.GmsReader(tasks.to_gms_file(self.mapshed_data())).read()
+        z = tasks.to_data_model(self.mapshed_data())
+
+        self.assertEqual(sorted(vars(z).keys()), sorted(vars(gms_z).keys()))
+        for key, gms_value in vars(gms_z).items():
+            value = getattr(z, key)
+            if isinstance(gms_value, numpy.ndarray):
+                self.assertEqual(value.dtype, gms_value.dtype, key)
+                self.assertEqual(value.tolist(), gms_value.tolist(), key)
+            else:
+                self.assertEqual(value, gms_value, key)
+
+
+@override_settings(GWLFE_SUBBASIN=dict(settings.GWLFE_SUBBASIN,
+                                       result_cache_size=2))
+class MapshedResultCacheTestCase(TestCase):
+    def setUp(self):
+        tasks._mapshed_results.clear()
+        self.jobs = [Job.objects.create(uuid=uuid.uuid4(), created_at=now(),
+                                        result=json.dumps({'job': i}),
+                                        error='', traceback='',
+                                        status='complete')
+                     for i in range(3)]
+
+    def tearDown(self):
+        tasks._mapshed_results.clear()
+
+    def test_mapshed_result_cache_hit(self):
+        job = self.jobs[0]
+        self.assertEqual(tasks.get_mapshed_result(job.uuid), {'job': 0})
+
+        Job.objects.filter(id=job.id).update(result=json.dumps({'job': -1}))
+
+        self.assertEqual(tasks.get_mapshed_result(job.uuid), {'job': 0})
+
+    def test_mapshed_result_cache_evicts_least_recent(self):
+        first, second, third = [job.uuid for job in self.jobs]
+
+        tasks.get_mapshed_result(first)
+        tasks.get_mapshed_result(second)
+        tasks.get_mapshed_result(first)
+        tasks.get_mapshed_result(third)
+
+        self.assertEqual(list(tasks._mapshed_results),
+                         [str(first), str(third)])
+
+    def test_mapshed_result_cache_returns_copies(self):
+        job = self.jobs[0]
+        result = tasks.get_mapshed_result(job.uuid)
+        result['job'] = -1
+
+        self.assertEqual(tasks.get_mapshed_result(job.uuid), {'job': 0})
+
+
+class SubbasinGwlfeChunksTestCase(TestCase):
+    def setUp(self):
+        tasks._mapshed_results.clear()
+        self.watershed_ids = ['020401010101', '020401010102', '020401010103']
+        # Earlier sub-basins take longer, so pooled runs finish out of order
+        self.gmss = {watershed_id: {'AgLength': 10.0 * (i + 1),
+                                    'StreamLength': 40.0,
+                                    'CN': [70, 75, 80],
+                                    'Delay': 0.1 * (3 - i)}
+                     for i, watershed_id in enumerate(self.watershed_ids)}
+        self.job = Job.objects.create(uuid=uuid.uuid4(), created_at=now(),
+                                      result=json.dumps(self.gmss),
+                                      error='', traceback='',
+                                      status='complete')
+
+        def run_gwlfe(model_input, inputmod_hash, watershed_id=None):
+            time.sleep(model_input['Delay'])
+            return {'inputmod_hash': inputmod_hash,
+                    'watershed_id': watershed_id,
+                    'n43': model_input['n43'],
+                    'CN': model_input['CN']}
+
+        # Pool processes are forked, so they run this too
+        self.original_run_gwlfe = tasks.run_gwlfe
+        tasks.run_gwlfe = run_gwlfe
+
+    def tearDown(self):
+        tasks.run_gwlfe = self.original_run_gwlfe
+        tasks._mapshed_results.clear()
+
+    def run_chunk(self, pool_size):
+        with self.settings(GWLFE_SUBBASIN=dict(settings.GWLFE_SUBBASIN,
+                                               pool_size=pool_size)):
+            return tasks.run_subbasin_gwlfe_chunks(
+                self.job.uuid, [{'n43': 2.0, 'CN__1': 60}],
+                {'ag': 60.0, 'urban': 60.0}, 'abc', self.watershed_ids)
+
+    def test_pooled_chunk_matches_serial(self):
+        serial = self.run_chunk(1)
+        pooled = self.run_chunk(3)
+
+        self.assertEqual(pooled, serial)
+        self.assertEqual([result['watershed_id'] for result in pooled],
+                         self.watershed_ids)
+        self.assertEqual([result['n43'] for result in pooled],
+                         [2.0 * (self.gmss[watershed_id]['AgLength'] / 60.0)
+                          for watershed_id in self.watershed_ids])
+        self.assertEqual(pooled[0]['CN'], [70, 60, 80])
+
+
+class JobPollingTestCase(TestCase):
+    def setUp(self):
+        self.c = APIClient()
+        self.result = {'survey': {'name': 'land', 'categories': []}}
+        self.job = Job.objects.create(uuid=uuid.uuid4(), created_at=now(),
+                                      result='', error='', traceback='',
+                                      status='started')
+        self.url = '/mmw/modeling/jobs/{}/'.format(self.job.uuid)
+
+    def test_job_not_modified(self):
+        response = self.c.get(self.url)
+        etag = response['ETag']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'started')
+
+        response = self.c.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_job_modified_when_delivered(self):
+        etag = self.c.get(self.url)['ETag']
+
+        self.job.result = json.dumps(self.result)
+        self.job.status = 'complete'
+        self.job.delivered_at = now()
+        self.job.save()
+
+        response = self.c.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['status'], 'complete')
+        self.assertEqual(response.data['result'], self.result)
+
+    @override_settings(JOB_WAIT_TIMEOUT=1)
+    def test_job_wait_is_capped(self):
+        start = time.time()
+        response = self.c.get(self.url, HTTP_PREFER='wait=60')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'started')
+        self.assertLess(time.time() - start, 5)
+
+
+class FakeRedis(object):
+    """
+    Delivers published messages to the subscribed FakePubSubs, calling
+    `on_wait` whenever one of them waits for a message.
+    """
+    def __init__(self, on_wait=lambda: None):
+        self.on_wait = on_wait
+        self.pubsubs = []
+
+    def publish(self, channel, message):
+        for pubsub in self.pubsubs:
+            if channel in pubsub.channels:
+                pubsub.messages.append({'type': 'message',
+                                        'channel': channel,
+                                        'data': message})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub(self)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = set()
+        self.messages = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+
+    def get_message(self, timeout=0):
+        self.redis.on_wait()
+        if self.messages:
+            return self.messages.pop(0)
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+class JobWaitTestCase(TestCase):
+    def setUp(self):
+        self.c = APIClient()
+        self.result = {'survey': {'name': 'land', 'categories': []}}
+        self.job = Job.objects.create(uuid=uuid.uuid4(), created_at=now(),
+                                      result='', error='', traceback='',
+                                      status='started')
+        self.url = '/mmw/modeling/jobs/{}/'.format(self.job.uuid)
+        self.original_get_redis_connection = \
+            notifications.get_redis_connection
+
+    def tearDown(self):
+        notifications.get_redis_connection = \
+            self.original_get_redis_connection
+
+    def use_redis(self, redis):
+        notifications.get_redis_connection = lambda alias: redis
+
+    @override_settings(JOB_WAIT_TIMEOUT=10)
+    def test_job_wait_woken_when_finished(self):
+        def finish_job():
+            if self.job.delivered_at is None:
+                self.job.result = json.dumps(self.result)
+                self.job.status = 'complete'
+                self.job.delivered_at = now()
+                self.job.save()
+                notifications.publish_job_finished(self.job.uuid)
+
+        redis = FakeRedis(on_wait=finish_job)
+        self.use_redis(redis)
+
+        start = time.time()
+        response = self.c.get(self.url, HTTP_PREFER='wait=10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'complete')
+        self.assertEqual(response.data['result'], self.result)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(redis.pubsubs), 1)
+        self.assertTrue(redis.pubsubs[0].closed)
+
+    @override_settings(JOB_WAIT_TIMEOUT=1)
+    def test_job_wait_times_out(self):
+        waits = []
+        redis = FakeRedis(on_wait=lambda: waits.append(1))
+        self.use_redis(redis)
+
+        response = self.c.get(self.url, HTTP_PREFER='wait=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'started')
+        self.assertIsNone(response.data['finished'])
+        self.assertTrue(waits)
+        self.assertTrue(redis.pubsubs[0].closed)
+
+    @override_settings(JOB_WAIT_TIMEOUT=0)
+    def test_job_wait_disabled(self):
+        redis = FakeRedis()
+        self.use_redis(redis)
+
+        response = self.c.get(self.url, HTTP_PREFER='wait=20')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'started')
+        self.assertEqual(redis.pubsubs, [])
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class PointSourcesTestCase(TestCase):
+    def setUp(self):
+        self.c = APIClient()
+        self.url = '/mmw/modeling/point-source/'
+        self.content = json.dumps({'type': 'FeatureCollection',
+                                   'features': []}).encode('utf-8')
+        cache.set('drb_point_sources_{}'.format(
+            settings.ANALYZE_SUMMARY_VERSION), ('abc', self.content))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_point_sources_not_modified(self):
+        response = self.c.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['ETag'], '"abc"')
+
+        response = self.c.get(self.url, HTTP_IF_NONE_MATCH='"abc"')
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_point_sources_bbox_not_cached(self):
+        bboxes = []
+
+        def get_drb_point_sources(bbox=None):
+            bboxes.append(bbox)
+            return '{"type": "FeatureCollection", "features": []}'
+
+        original = views.get_drb_point_sources
+        views.get_drb_point_sources = get_drb_point_sources
+        try:
+            for _ in range(2):
+                response = self.c.get(self.url, {'bbox': '-76,39,-75,40'})
+                self.assertEqual(response.status_code, 200)
+        finally:
+            views.get_drb_point_sources = original
+
+        self.assertEqual(bboxes, [(-76.0, 39.0, -75.0, 40.0)] * 2)
+
+    def test_point_sources_query(self):
+        cache.clear()
+
+        # Point sources aren't loaded in tests
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                CREATE TEMPORARY TABLE ms_pointsource_drb (
+                    geom geometry(Point, 4326), city varchar, state varchar,
+                    npdes_id varchar, mgd numeric, kgn_yr numeric,
+                    kgp_yr numeric, facilityname varchar)
+                ''')
+            cursor.execute('''
+                INSERT INTO ms_pointsource_drb VALUES
+                (ST_SetSRID(ST_MakePoint(-75.2, 40.0), 4326), 'PHILADELPHIA',
+                 'PA', '0011657', 41.06, 0, 2.5, 'Plant'),
+                (ST_SetSRID(ST_MakePoint(-74.5, 41.5), 4326), 'MONTAGUE',
+                 'NJ', '0022345', NULL, 1.5, NULL, 'Mill')
+                ''')
+
+        everything = json.loads(calcs.get_drb_point_sources())
+        in_bbox = json.loads(calcs.get_drb_point_sources((-76, 39, -75, 40.5)))
+        empty = json.loads(calcs.get_drb_point_sources((0, 0, 1, 1)))
+
+        self.assertEqual(len(everything['features']), 2)
+        self.assertEqual(in_bbox['features'], [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [-75.2, 40.0]},
+            'properties': {'city': 'PHILADELPHIA', 'state': 'PA',
+                           'npdes_id': '0011657', 'mgd': 41.06,
+                           'kgn_yr': None, 'kgp_yr': 2.5,
+                           'facilityname': 'Plant'},
+        }])
+        self.assertEqual(empty, {'type': 'FeatureCollection',
+                                 'features': []})
+
+        response = self.c.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), everything)
+
+        response = self.c.get(self.url, {'bbox': '-76,39,-75,40.5'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), in_bbox)
+
+    def test_point_sources_invalid_bbox(self):
+        for bbox in ['1,2,3', '1,2,3,x']:
+            response = self.c.get(self.url, {'bbox': bbox})
+
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class GeoprocessingCacheTestCase(TestCase):
+    def setUp(self):
+        self.versions = OrderedDict(
+            (op['label'], geoprocessing.operation_version(op))
+            for op in settings.GEOP['json']['mapshed']['operations']
+            if op.get('name') != 'RasterLinesJoin')
+        self.labels = list(self.versions)
+        self.results = {
+            'huc12__1': {label: {'List(1)': 1} for label in self.labels},
+            'huc12__2': {self.labels[0]: {'List(2)': 2}},
+        }
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_get_cached_results(self):
+        geoprocessing.set_cached_results(self.results, self.versions)
+
+        cached = geoprocessing.get_cached_results(
+            ['huc12__1', 'huc12__2', 'huc12__3'], self.versions)
+
+        self.assertEqual(cached, self.results)
+
+    def test_multi_returns_cached_results(self):
+        geoprocessing.set_cached_results(self.results, self.versions)
+        shapes = [{'id': 'huc12__1', 'shape': {}}]
+
+        output = geoprocessing.multi('mapshed', shapes, None)
+
+        self.assertEqual(output, {'huc12__1': self.results['huc12__1']})
+
+    def test_multi_runs_missing_operations(self):
+        geoprocessing.set_cached_results(self.results, self.versions)
+        shapes = [{'id': 'huc12__1', 'shape': {}},
+                  {'id': 'huc12__2', 'shape': {}},
+                  {'id': 'huc12__3', 'shape': {}}]
+        requests = []
+
+        def geoprocess(endpoint, data):
+            requests.append(([s['id'] for s in data['shapes']],
+                             [o['label'] for o in data['operations']]))
+            return {s['id']: {o['label']: {'List(3)': 3}
+                              for o in data['operations']}
+                    for s in data['shapes']}
+
+        original_geoprocess = geoprocessing.geoprocess
+        geoprocessing.geoprocess = geoprocess
+        try:
+            output = geoprocessing.multi('mapshed', shapes, None)
+        finally:
+            geoprocessing.geoprocess = original_geoprocess
+
+        self.assertEqual(requests, [(['huc12__2'], self.labels[1:]),
+                                    (['huc12__3'], self.labels)])
+        self.assertEqual(output['huc12__1'], self.results['huc12__1'])
+        self.assertEqual(output['huc12__2'][self.labels[0]], {'List(2)': 2})
+        self.assertEqual(output['huc12__2'][self.labels[1]], {'List(3)': 3})
+        self.assertEqual(len(output['huc12__3']), len(self.labels))
+        self.assertEqual(
+            geoprocessing.get_cached_results(['huc12__3'], self.versions),
+            {'huc12__3': output['huc12__3']})
+
+    def test_shape_cache_id_normalizes_shapes(self):
+        square = {'type': 'Polygon',
+                  'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+        # The same square, rotated, reversed and off by a rounding error
+        same_square = {'type': 'Polygon',
+                       'coordinates': [[[1, 1], [1, 0], [0.0000001, 0],
+                                        [0, 1], [1, 1]]]}
+        other_square = {'type': 'Polygon',
+                        'coordinates': [[[0, 0], [2, 0], [2, 2], [0, 2],
+                                         [0, 0]]]}
+
+        shape_id = geoprocessing.shape_cache_id([square])
+
+        self.assertTrue(shape_id.startswith(geoprocessing.SHAPE_CACHE_PREFIX))
+        self.assertEqual(shape_id, geoprocessing.shape_cache_id(
+            [json.dumps(same_square)]))
+        self.assertNotEqual(shape_id, geoprocessing.shape_cache_id(
+            [other_square]))
+
+    def test_uncacheable_shapes_are_not_cached(self):
+        # Collapses to two points when rounded
+        sliver = {'type': 'Polygon',
+                  'coordinates': [[[0, 0], [1, 0], [1, 0.0000001],
+                                   [0, 0]]]}
+        shapes = [{'id': geoprocessing.NOWKAOI, 'shape': 'not json'}]
+
+        self.assertIsNone(geoprocessing.safe_shape_cache_id([sliver]))
+
+        def geoprocess(endpoint, data):
+            if endpoint == 'run':
+                return {'List(1)': 1}
+            return {s['id']: {o['label']: {'List(1)': 1}
+                              for o in data['operations']}
+                    for s in data['shapes']}
+
+        original_geoprocess = geoprocessing.geoprocess
+        geoprocessing.geoprocess = geoprocess
+        try:
+            run_output = geoprocessing.run('nlcd', {'polygon': [sliver]})
+            multi_output = geoprocessing.multi('mapshed', shapes, None)
+        finally:
+            geoprocessing.geoprocess = original_geoprocess
+
+        self.assertEqual(run_output, {'List(1)': 1})
+        self.assertEqual(len(multi_output[geoprocessing.NOWKAOI]),
+                         len(self.labels))
+
+    def test_operation_version(self):
+        run_op = settings.GEOP['json']['nlcd_soil']['input']
+        multi_op = settings.GEOP['json']['mapshed']['operations'][0]
+        other_op = dict(multi_op, rasters=['nlcd-2019-30m-epsg5070'])
+
+        self.assertEqual(multi_op['label'], 'nlcd_soil')
+        self.assertEqual(geoprocessing.operation_version(run_op),
+                         geoprocessing.operation_version(multi_op))
+        self.assertNotEqual(geoprocessing.operation_version(multi_op),
+                            geoprocessing.operation_version(other_op))
+
+    def test_single_flight_computes_once(self):
+        def compute():
+            return {'List(1)': 1}
+
+        result = geoprocessing.single_flight('key', lambda: None, compute)
+
+        self.assertEqual(result, {'List(1)': 1})
+        self.assertIsNone(cache.get('lock_key'))
+
+    def test_single_flight_waits_for_lock_holder(self):
+        cache.add('lock_key', True)
+
+        def compute():
+            self.fail('Result was computed while locked')
+
+        result = geoprocessing.single_flight(
+            'key', lambda: {'List(1)': 1}, compute)
+
+        self.assertEqual(result, {'List(1)': 1})
+        self.assertTrue(cache.get('lock_key'))
+
+    def test_single_flight_coalesces_empty_results(self):
+        cache.add('lock_key', True)
+
+        def compute():
+            self.fail('Result was computed while locked')
+
+        result = geoprocessing.single_flight('key', dict, compute)
+
+        self.assertEqual(result, {})
+
+    def test_single_flight_retries_while_locked(self):
+        cache.add('lock_key', True)
+        retries = []
+
+        def retry(**kwargs):
+            retries.append(kwargs)
+            raise Retry()
+
+        def compute():
+            self.fail('Result was computed while locked')
+
+        with self.assertRaises(Retry):
+            geoprocessing.single_flight('key', lambda: None, compute, retry)
+
+        self.assertEqual(len(retries), 1)
+        self.assertTrue(cache.get('lock_key'))
+
+    @override_settings(GEOP=dict(settings.GEOP, lock_wait=0))
+    def test_single_flight_keeps_others_lock_on_timeout(self):
+        cache.add('lock_key', True)
+
+        def retry(**kwargs):
+            raise MaxRetriesExceededError()
+
+        result = geoprocessing.single_flight(
+            'key', lambda: None, lambda: {'List(1)': 1}, retry)
+
+        self.assertEqual(result, {'List(1)': 1})
+        self.assertTrue(cache.get('lock_key'))
+
+        result = geoprocessing.single_flight(
+            'key', lambda: None, lambda: {'List(2)': 2})
+
+        self.assertEqual(result, {'List(2)': 2})
+        self.assertTrue(cache.get('lock_key'))
+
+
+class CountyOverlaysTestCase(TestCase):
+    def test_county_overlays_without_geoms(self):
+        self.assertEqual(county_overlays([]), [])
+
+
+class WeatherCubeTestCase(TestCase):
+    def setUp(self):
+        rand = random.Random(1)
+
+        def row(station, year, month):
+            # Months are numeric, as extracted by the query
+            return ([station, year, Decimal(month)] +
+                    [round(rand.uniform(0, 90), 2) for day in range(31)])
+
+        # Station 20 has no rows, and the TMax and TMin of station 10 in
+        # January 2000 appear as separate rows
+        self.stations = (30, 10, 20)
+        self.rows = [row(30, 2000, 1), row(10, 2000, 1), row(10, 2000, 1),
+                     row(30, 2000, 2), row(10, 2001, 12), row(30, 2001, 12),
+                     row(30, 2001, 12)]
+
+    def fill(self, rows, stations, begyear, year_range, convert):
+        """
+        The row by row fill weather_cube replaced, as a reference.
+        """
+        cube = {station_id: [[[0] * 31 for m in range(12)]
+                             for y in range(year_range)]
+                for station_id in stations}
+        for row in rows:
+            station = int(row[0])
+            year = int(row[1]) - begyear
+            month = int(row[2]) - 1
+            for day in range(31):
+                cube[station][year][month][day] = convert(float(row[day + 3]))
+
+        return numpy.array([cube[station_id] for station_id in stations])
+
+    def test_weather_cube_matches_row_fill(self):
+        def f_to_c(f):
+            return (f - 32) * 5.0 / 9.0
+
+        for convert in [f_to_c, lambda i: i * 2.54]:
+            expected = self.fill(self.rows, self.stations, 2000, 2, convert)
+            actual = weather_cube(self.rows, self.stations, 2000, 2, convert)
+
+            self.assertEqual(actual.shape, (3, 2, 12, 31))
+            numpy.testing.assert_allclose(actual, expected)
+
+    def test_weather_cube_last_row_wins(self):
+        cube = weather_cube(self.rows, self.stations, 2000, 2, lambda v: v)
+
+        numpy.testing.assert_allclose(cube[1, 0, 0], self.rows[2][3:])
+        numpy.testing.assert_allclose(cube[0, 1, 11], self.rows[6][3:])
+
+    def test_weather_cube_missing_stations(self):
+        cube = weather_cube(self.rows, self.stations, 2000, 2, lambda v: v)
+        empty = weather_cube([], self.stations, 2000, 2, lambda v: v)
+
+        self.assertFalse(cube[2].any())
+        self.assertEqual(empty.shape, (3, 2, 12, 31))
+        self.assertFalse(empty.any())
+
+
+class WarmGeopCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.progress = '{}/progress'.format(self.tmpdir)
+
+        # HUC boundaries aren't loaded in tests
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                CREATE TEMPORARY TABLE boundary_huc12 (id integer,
+                                                       huc12 varchar(12))
+                ''')
+            cursor.execute('''
+                INSERT INTO boundary_huc12
+                VALUES (1, '020401010101'), (2, '020402010101'),
+                       (3, '020501010101'), (4, '020401010102')
+                ''')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def warm(self, *args):
+        out = StringIO()
+        call_command('warm_geop_cache', *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_dry_run_selects_hucs_in_region(self):
+        with open(self.progress, 'w') as f:
+            f.write('huc12__4\n')
+
+        lines = self.warm('--huc', 'huc12', '--region', '0204',
+                          '--progress', self.progress, '--dry-run')
+
+        self.assertEqual(lines, ['Warming 2 areas of interest',
+                                 'huc12__1', 'huc12__2'])
+
+    def test_region_requires_huc(self):
+        with self.assertRaises(CommandError):
+            self.warm('--region', '0204', '--dry-run')
+
+    def test_failed_batches_are_skipped(self):
+        def warm_shapes(command, wkaois):
+            if wkaois == ['huc12__2']:
+                raise Retry()
+            if wkaois == ['huc12__3']:
+                raise ValueError('Bad shape')
+            return True
+
+        original_warm_shapes = warm_geop_cache.Command.warm_shapes
+        warm_geop_cache.Command.warm_shapes = warm_shapes
+        try:
+            lines = self.warm('--huc', 'huc12', '--batch-size', '1',
+                              '--workers', '2', '--progress', self.progress)
+        finally:
+            warm_geop_cache.Command.warm_shapes = original_warm_shapes
+
+        with open(self.progress) as f:
+            warmed = sorted(line.strip() for line in f)
+
+        self.assertEqual(warmed, ['huc12__1', 'huc12__4'])
+        self.assertIn('Warmed 4 of 4', lines)
+        self.assertIn('Error warming huc12__3: Bad shape', lines)
+
+
+class ParseKeyTestCase(TestCase):
+    def test_parse_key_matches_literal_eval(self):
+        rand = random.Random(0)
+        keys = ['List()', 'List(1,)', 'List(1, 2)', 'List(0.5)']
+
+        for _ in range(1000):
+            values = [rand.randint(-2 ** 31, 2 ** 31)
+                      for _ in range(rand.randint(1, 4))]
+            keys.append('List({})'.format(','.join(str(v) for v in values)))
+
+        for key in keys:
+            expected = literal_eval(key[4:])
+            self.assertEqual(geoprocessing.parse_key(key), expected)
+            # Parsed again from the remembered keys
+            self.assertEqual(geoprocessing.parse_key(key), expected)
+
+    def test_parse(self):
+        self.assertEqual(geoprocessing.parse({'List(1,2)': 3, 'List(4)': 5}),
+                         {(1, 2): 3, 4: 5})
+
+
+class PerimeterTestCase(TestCase):
+    def square(self, x, y, size=0.01):
+        return GEOSGeometry(json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[x, y], [x + size, y], [x + size, y + size],
+                             [x, y + size], [x, y]]]
+        }), srid=4326)
+
+    def test_within_perimeter(self):
+        philadelphia = self.square(-75.2, 40.0)
+        san_francisco = self.square(-122.45, 37.75)
+        pittsburgh = self.square(-80.0, 40.44)
+
+        for name in ['DRB_PERIMETER', 'DRB_SIMPLE_PERIMETER']:
+            self.assertTrue(calcs.within_perimeter(philadelphia, name))
+            self.assertFalse(calcs.within_perimeter(san_francisco, name))
+            self.assertEqual(calcs.within_perimeter(pittsburgh, name),
+                             pittsburgh.within(getattr(settings, name)))
+
+        self.assertTrue(calcs.within_perimeter(san_francisco,
+                                               'CONUS_PERIMETER'))
+
+    def test_within_perimeter_straddling(self):
+        aoi = self.square(-75.2, 40.0, size=20)
+
+        self.assertFalse(calcs.within_perimeter(aoi, 'DRB_PERIMETER'))
@@ -3,12 +3,11 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
-import json
-
 from django.conf import settings
-from django.contrib.gis.geos import GEOSGeometry
 from rest_framework.exceptions import ValidationError
 
+from apps.modeling.calcs import within_perimeter
+
 
 def validate_aoi(aoi):
     if not check_analyze_aoi_size_below_max_area(aoi):
@@ -56,6 +55,4 @@ def create_shape_exceeds_conus_error_msg(aoi):
 
 
 def check_shape_in_conus(aoi):
-    conus_boundaries = GEOSGeometry(
-        json.dumps(settings.CONUS_PERIMETER['geometry']), 4326)
-    return conus_boundaries.contains(aoi)
+    return within_perimeter(aoi, 'CONUS_PERIMETER')
@@ -2,7 +2,9 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
 import json
+import re
 import urllib
 
 from celery import chain, group
@@ -16,19 +18,22 @@ from rest_framework.permissions import (AllowAny,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
-from django.db import connection
 from django.db.models.sql import EmptyResultSet
 from django.http import (HttpResponse,
                          Http404,
                          )
+from django.utils.http import parse_etags, quote_etag
 
 from django.core.servers.basehttp import FileWrapper
 
 from apps.core.models import Job
 from apps.core.tasks import save_job_error, save_job_result
 from apps.core.decorators import log_request
+from apps.core.notifications import wait_for_job_finished
 from apps.modeling import tasks, geoprocessing
 from apps.modeling.mapshed.tasks import (multi_subbasin,
                                          multi_mapshed,
@@ -45,6 +50,7 @@ from apps.modeling.serializers import (ProjectSerializer,
 from apps.modeling.calcs import (get_layer_shape,
                                  get_huc12s,
                                  get_catchments,
+                                 get_drb_point_sources,
                                  apply_gwlfe_modifications,
                                  boundary_search_context,
                                  split_into_huc12s,
@@ -197,7 +203,7 @@ def start_gwlfe(request, format=None):
 
     if mapshed_job_uuid:
         mapshed_job = get_object_or_404(Job, uuid=mapshed_job_uuid)
-        model_input = json.loads(mapshed_job.result)
+        model_input = mapshed_job.get_result()
     else:
         model_input = json.loads(request.POST.get('model_input'))
 
@@ -244,9 +250,12 @@ def _initiate_gwlfe_job_chain(model_input, modifications,
 
 def _initiate_subbasin_gwlfe_job_chain(model_input, mapshed_job_uuid,
                                        modifications, inputmod_hash,
-                                       job_id, chunk_size=8):
+                                       job_id, chunk_size=None):
     errback = save_job_error.s(job_id)
 
+    if chunk_size is None:
+        chunk_size = settings.GWLFE_SUBBASIN['chunk_size']
+
     # Split the sub-basin ids into a list of lists. (We'll refer to
     # each inner list as a "chunk")
     watershed_ids = list(model_input.keys())
@@ -459,7 +468,7 @@ def _construct_tr55_job_chain(model_input, job_id):
 def subbasins_detail(request):
     mapshed_job_uuid = request.query_params.get('mapshed_job_uuid')
     mapshed_job = Job.objects.get(uuid=mapshed_job_uuid)
-    gmss = json.loads(mapshed_job.result)
+    gmss = mapshed_job.get_result()
     if gmss:
         huc12s = get_huc12s(gmss.keys())
         return Response(huc12s)
@@ -504,41 +513,58 @@ def boundary_layer_search(request):
 @decorators.api_view(['GET'])
 @decorators.permission_classes((AllowAny, ))
 def drb_point_sources(request):
-    query = '''
-          SELECT ST_X(geom) as lon, ST_Y(geom) as lat, city, state, npdes_id,
-                 mgd, kgn_yr, kgp_yr, facilityname
-          FROM ms_pointsource_drb
-          '''
-
-    point_source_results = {u'type': u'FeatureCollection', u'features': []}
-
-    with connection.cursor() as cursor:
-        cursor.execute(query)
-
-        point_source_array = [
-            {
-                'type': 'Feature',
-                'geometry': {
-                    'type': 'Point',
-                    'coordinates': [row[0], row[1]],
-                },
-                'properties': {
-                    'city': row[2],
-                    'state': row[3],
-                    'npdes_id': row[4],
-                    'mgd': float(row[5]) if row[5] else None,
-                    'kgn_yr': float(row[6]) if row[6] else None,
-                    'kgp_yr': float(row[7]) if row[7] else None,
-                    'facilityname': row[8]
-                }
-
-            } for row in cursor.fetchall()
-        ]
-
-    point_source_results['features'] = point_source_array
-
-    return Response(json.dumps(point_source_results),
-                    headers={'Cache-Control': 'max-age: 604800'})
+    """
+    Returns the DRB point sources as a GeoJSON FeatureCollection, limited to
+    those within the optional `bbox` query parameter, given as
+    "xmin,ymin,xmax,ymax". The serialized collection of all point sources is
+    cached for the current ANALYZE_SUMMARY_VERSION. The hash of the
+    collection is used as an ETag.
+    """
+    bbox = request.query_params.get('bbox')
+    if bbox:
+        try:
+            bbox = tuple(float(c) for c in bbox.split(','))
+        except ValueError:
+            bbox = ()
+
+        if len(bbox) != 4:
+            return Response('Invalid bbox, expected xmin,ymin,xmax,ymax',
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    # Only the whole collection is cached, since any bbox can be requested
+    if bbox:
+        content = get_drb_point_sources(bbox).encode('utf-8')
+        etag = hashlib.md5(content).hexdigest()
+    else:
+        etag, content = _get_all_drb_point_sources()
+
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'max-age=604800'}
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response = HttpResponse(content, content_type='application/json')
+    for header, value in headers.iteritems():
+        response[header] = value
+
+    return response
+
+
+def _get_all_drb_point_sources():
+    """
+    Returns the hash and serialized collection of all DRB point sources,
+    cached for ANALYZE_CACHE_TIMEOUT seconds.
+    """
+    key = 'drb_point_sources_{}'.format(settings.ANALYZE_SUMMARY_VERSION)
+    cached = cache.get(key)
+
+    if cached is None:
+        content = get_drb_point_sources().encode('utf-8')
+        cached = (hashlib.md5(content).hexdigest(), content)
+        cache.set(key, cached, settings.ANALYZE_CACHE_TIMEOUT)
+
+    return cached
 
 
 @decorators.api_view(['GET'])
@@ -550,6 +576,11 @@ def get_job(request, job_uuid, format=None):
     """
     Get a job's status. If it's complete, get its result.
 
+    To wait for the job to finish instead of polling repeatedly, pass a
+    number of seconds to wait for, as the `wait` query parameter or a
+    `Prefer: wait=N` header. The response is sent as soon as the job
+    finishes, or when the wait is over.
+
     ---
     type:
       job_uuid:
@@ -578,41 +609,119 @@ def get_job(request, job_uuid, format=None):
          description: Format "Token&nbsp;YOUR_API_TOKEN_HERE". When using
                       Swagger you may wish to set this for all requests via
                       the field at the top right of the page.
+       - name: wait
+         paramType: query
+         type: integer
+         description: Seconds to wait for the job to finish before
+                      responding
     """
     # TODO consider if we should have some sort of session id check to ensure
     # you can only view your own jobs.
     try:
-        job = Job.objects.get(uuid=job_uuid)
+        # The result is only loaded if it needs to be sent
+        job = Job.objects.defer('model_input', 'result', 'compressed_result',
+                                'traceback').get(uuid=job_uuid)
     except Job.DoesNotExist:
         raise Http404("Not found.")
 
     # Get the user so that logged in users can only see jobs that they started
     # or anonymous ones
     user = request.user if request.user.is_authenticated() else None
-    if job.user and job.user != user:
+    if job.user_id and job.user_id != getattr(user, 'id', None):
         raise Http404("Not found.")
 
+    wait = _get_job_wait(request)
+    if wait and job.delivered_at is None:
+        unfinished_job = Job.objects.defer('model_input', 'result',
+                                           'compressed_result', 'traceback')
+
+        def is_finished():
+            return unfinished_job.filter(id=job.id,
+                                         delivered_at__isnull=False).exists()
+
+        if wait_for_job_finished(job.uuid, wait, is_finished):
+            job = unfinished_job.get(id=job.id)
+
+    # A job only changes when its status does, or when it is delivered, so
+    # clients that already have this version of it can be told so without
+    # sending the result again
+    etag = _job_etag(job)
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
     # TODO Should we return the error? Might leak info about the internal
     # workings that we don't want exposed.
 
-    # Parse results to json if it is valid json
-    try:
-        result = json.loads(job.result)
-    except ValueError:
-        result = job.result
-
     return Response(
         {
             'job_uuid': job.uuid,
             'status': job.status,
-            'result': result,
+            'result': _get_job_result(job, etag),
             'error': job.error,
             'started': job.created_at,
             'finished': job.delivered_at,
-        }
+        },
+        headers=headers
     )
 
 
+def _get_job_wait(request):
+    """
+    Returns how many seconds the request asks get_job to wait for the job to
+    finish, up to JOB_WAIT_TIMEOUT.
+    """
+    wait = request.query_params.get('wait')
+    if wait is None:
+        prefer = request.META.get('HTTP_PREFER', '')
+        match = re.search(r'\bwait=(\d+)', prefer)
+        wait = match.group(1) if match else 0
+
+    try:
+        return max(0, min(int(wait), settings.JOB_WAIT_TIMEOUT))
+    except ValueError:
+        return 0
+
+
+def _job_etag(job):
+    version = '{}:{}:{}'.format(job.uuid, job.status,
+                                job.delivered_at.isoformat()
+                                if job.delivered_at else '')
+    return hashlib.md5(version.encode('utf-8')).hexdigest()
+
+
+def _get_job_result(job, etag):
+    """
+    Returns the job's result, parsed if it is valid JSON. Results are only
+    saved when a job is delivered, and do not change after, so results of
+    finished jobs are cached for JOB_RESULT_CACHE_TIMEOUT seconds to spare
+    the database from repeated polling.
+    """
+    if job.delivered_at is None:
+        return ''
+
+    key = 'job_result_{}'.format(etag)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    result_json = Job.objects.only('result', 'compressed_result') \
+                             .get(id=job.id) \
+                             .get_result_json()
+
+    # Parse results to json if it is valid json
+    try:
+        result = json.loads(result_json)
+    except ValueError:
+        result = result_json
+
+    cache.set(key, result, settings.JOB_RESULT_CACHE_TIMEOUT)
+
+    return result
+
+
 def _parse_input(model_input):
     serializer = AoiSerializer(data=model_input)
     serializer.is_valid(raise_exception=True)
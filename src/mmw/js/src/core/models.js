@@ -314,8 +314,7 @@ var ObservationsLayerGroupModel = LayerGroupModel.extend({
 
                 if (pointSourceData) {
                     try {
-                        var parsedPointSource = JSON.parse(pointSourceData[0]),
-                            numberOfPoints = parsedPointSource.features.length;
+                        var numberOfPoints = pointSourceData[0].features.length;
                         observationLayersCollection.add({
                             leafletLayer: pointSourceLayer.Layer.createLayer(pointSourceData[0], map),
                             display: 'EPA Permitted Point Sources (' + numberOfPoints + ')',
@@ -497,6 +496,12 @@ var TaskModel = Backbone.Model.extend({
            areas of interest, etc). In most cases, back-end jobs will
            finish or fail before this is hit. */
         timeout: 160000,
+        /* Seconds the server may hold each poll open waiting for the
+           job to finish, so results arrive as soon as they are ready.
+           The server caps this to MMW_JOB_WAIT_TIMEOUT, which is 0 by
+           default, so until that is set polls return right away and
+           pollInterval applies as before. */
+        wait: 20
     },
 
     url: function(queryParams) {
@@ -577,16 +582,19 @@ var TaskModel = Backbone.Model.extend({
         // associated with a single call to start(). If start()
         // is called again, the values of this.get('job') and
         // startJob will diverge.
-        var elapsed = 0,
+        var startTime = Date.now(),
             self = this,
-            startJob = self.get('job');
+            startJob = self.get('job'),
+            headers = _.extend({}, self.headers(), {
+                'Prefer': 'wait=' + self.get('wait')
+            });
 
         // Check the task endpoint to see if the job is
         // completed. If it is, return the results of
         // the job. If not, check again after
         // pollInterval has elapsed.
         var getResults = function() {
-            if (elapsed >= self.get('timeout')) {
+            if (Date.now() - startTime >= self.get('timeout')) {
                 defer.reject({timeout: true});
                 return;
             }
@@ -597,11 +605,10 @@ var TaskModel = Backbone.Model.extend({
                 return;
             }
 
-            self.fetch({ headers: self.headers() })
+            self.fetch({ headers: headers })
                 .done(function(response) {
                     console.log('Polling ' + self.url());
                     if (response.status === 'started') {
-                        elapsed = elapsed + self.get('pollInterval');
                         window.setTimeout(getResults, self.get('pollInterval'));
                     } else if (response.status === 'complete') {
                         defer.resolve(response);
@@ -14,7 +14,7 @@ var markerSizesForZoomLevels = [
 
 var Layer = {
     createLayer: function(geojsonFeatureCollection, leafletMap) {
-        return L.geoJson(JSON.parse(geojsonFeatureCollection), {
+        return L.geoJson(geojsonFeatureCollection, {
             pointToLayer: function (feature, latlng) {
                 return L.circleMarker(latlng, {
                     fillColor: "#ff7800",
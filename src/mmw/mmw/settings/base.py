@@ -148,6 +148,38 @@ TASK_REQUEST_TIMEOUT = CELERY_TASK_TIME_LIMIT - 10
 # END CELERY CONFIGURATION
 
 
+# JOB CONFIGURATION
+# Store job results zlib compressed. Existing results can be converted with
+# the compress_job_results management command.
+JOB_RESULT_COMPRESSION = bool(int(environ.get('MMW_JOB_RESULT_COMPRESSION',
+                                              0)))
+# How long, in seconds, get_job caches the results of finished jobs
+JOB_RESULT_CACHE_TIMEOUT = int(environ.get('MMW_JOB_RESULT_CACHE_TIMEOUT',
+                                           300))
+# The longest, in seconds, get_job will wait for a job to finish when asked
+# to with the wait parameter or a "Prefer: wait=N" header. Each waiting
+# request holds an app server worker, so this is off by default. Until it is
+# set, the "Prefer: wait=20" header the front end sends on every poll has no
+# effect, and jobs are polled every second as before.
+JOB_WAIT_TIMEOUT = int(environ.get('MMW_JOB_WAIT_TIMEOUT', 0))
+# END JOB CONFIGURATION
+
+
+# ANALYZE CONFIGURATION
+# The version of the data the precomputed Analyze summaries of well-known
+# areas of interest were computed from. Increment it after loading new data,
+# and run the refresh_analyze_summaries management command. Summaries of
+# other versions are ignored, and the surveys computed live instead. Cached
+# surveys and point source layers are also keyed by it.
+ANALYZE_SUMMARY_VERSION = environ.get('MMW_ANALYZE_SUMMARY_VERSION', '1')
+# How long, in seconds, the results of the Analyze surveys computed from
+# PostGIS tables are cached, keyed by the area of interest and the version
+# above. Defaults to one week.
+ANALYZE_CACHE_TIMEOUT = int(environ.get('MMW_ANALYZE_CACHE_TIMEOUT',
+                                        60 * 60 * 24 * 7))
+# END ANALYZE CONFIGURATION
+
+
 # LOGGING CONFIGURATION
 LOGGING = {
     'version': 1,
@@ -439,11 +471,71 @@ SRAT_CATCHMENT_API = {
                            'ERROR: Could not get SRAT Catchment API Key'),
 }
 
+# MapShed Settings
+MAPSHED = {
+    # Directory of the weather store written by `export_weather_store`.
+    # When set and exported, MapShed reads weather from it instead of
+    # querying ms_weather.
+    'weather_store': environ.get('MMW_MAPSHED_WEATHER_STORE', None),
+}
+
+# Sub-basin GWLF-E Settings
+GWLFE_SUBBASIN = {
+    # Number of sub-basins run by each Celery task
+    'chunk_size': int(environ.get('MMW_GWLFE_SUBBASIN_CHUNK_SIZE', 8)),
+    # Number of processes each task runs its chunk's sub-basins across.
+    # 1 runs them one after another in the Celery worker itself.
+    'pool_size': int(environ.get('MMW_GWLFE_SUBBASIN_POOL_SIZE', 1)),
+    # Number of parsed MapShed results each worker process keeps in memory
+    'result_cache_size': int(environ.get(
+        'MMW_GWLFE_SUBBASIN_RESULT_CACHE_SIZE', 4)),
+}
+
 # Geoprocessing Settings
+
+# Average precipitation and temperature for each month, labelled ppt1, ...,
+# ppt12 and tmean1, ..., tmean12
+CLIMATE_OPERATIONS = [
+    {
+        'name': 'RasterGroupedAverage',
+        'label': '{}{}'.format(var, month),
+        'targetRaster': 'climatology-{}-{:02d}-epsg5070'.format(var, month),
+        'rasters': [],
+        'pixelIsArea': True
+    }
+    for var in ['ppt', 'tmean']
+    for month in range(1, 13)
+]
+
 GEOP = {
     'cache': bool(int(environ.get('MMW_GEOPROCESSING_CACHE', 1))),
+    # Results for shapes that are not well-known areas of interest are cached
+    # for this many seconds under a hash of the shape, with its coordinates
+    # rounded to this many decimal places
+    'shape_cache_timeout': int(environ.get(
+        'MMW_GEOPROCESSING_SHAPE_CACHE_TIMEOUT', 7 * 24 * 60 * 60)),
+    'shape_cache_precision': int(environ.get(
+        'MMW_GEOPROCESSING_SHAPE_CACHE_PRECISION', 6)),
+    # Cached results are keyed by a fingerprint of each operation's rasters.
+    # Change this to invalidate them when rasters are updated in place.
+    'cache_version': environ.get('MMW_GEOPROCESSING_CACHE_VERSION', '1'),
+    # Tasks are retried for up to lock_wait seconds while another task is
+    # already running the same operation, before running it themselves. By
+    # default that is as long as the other task's request may take. Locks
+    # expire after lock_timeout seconds in case the task holding one dies.
+    'lock_wait': int(environ.get('MMW_GEOPROCESSING_LOCK_WAIT',
+                                 TASK_REQUEST_TIMEOUT)),
+    'lock_timeout': TASK_REQUEST_TIMEOUT + 10,
     'host': environ.get('MMW_GEOPROCESSING_HOST', 'localhost'),
     'port': environ.get('MMW_GEOPROCESSING_PORT', '8090'),
+    # Connections to the geoprocessing service kept alive per worker process,
+    # and how many times to retry failed connections, waiting
+    # retry_backoff * 2 ^ (retries - 1) seconds between them
+    'pool_size': int(environ.get('MMW_GEOPROCESSING_POOL_SIZE', 10)),
+    'connect_retries': int(environ.get('MMW_GEOPROCESSING_CONNECT_RETRIES',
+                                       6)),
+    'retry_backoff': float(environ.get('MMW_GEOPROCESSING_RETRY_BACKOFF',
+                                       0.5)),
     'args': 'context=geoprocessing&appName=geoprocessing-%s&classPath=org.wikiwatershed.mmw.geoprocessing.MapshedJob' % environ.get('MMW_GEOPROCESSING_VERSION', '0.1.0'),  # NOQA
     'json': {
         'nlcd': {
@@ -557,30 +649,6 @@ GEOP = {
                 'zoom': 0
             }
         },
-        'ppt': {
-            'input': {
-                'polygon': [],
-                'polygonCRS': 'LatLng',
-                'rasters': [],
-                'targetRaster': 'climatology-ppt-{:02d}-epsg5070',
-                'pixelIsArea': True,
-                'rasterCRS': 'ConusAlbers',
-                'operationType': 'RasterGroupedAverage',
-                'zoom': 0
-            }
-        },
-        'tmean': {
-            'input': {
-                'polygon': [],
-                'polygonCRS': 'LatLng',
-                'rasters': [],
-                'targetRaster': 'climatology-tmean-{:02d}-epsg5070',
-                'pixelIsArea': True,
-                'rasterCRS': 'ConusAlbers',
-                'operationType': 'RasterGroupedAverage',
-                'zoom': 0
-            }
-        },
         'soiln': {
             'input': {
                 'polygon': [],
@@ -630,6 +698,38 @@ GEOP = {
                 'zoom': 0
             }
         },
+        'climate': {
+            'shapes': [],
+            'streamLines': '',
+            'operations': CLIMATE_OPERATIONS
+        },
+        'analyze': {
+            'shapes': [],
+            'streamLines': '',
+            'operations': [
+                {
+                    'name': 'RasterGroupedCount',
+                    'label': 'nlcd',
+                    'rasters': [
+                        'nlcd-2011-30m-epsg5070-512-int8'
+                    ]
+                },
+                {
+                    'name': 'RasterGroupedCount',
+                    'label': 'soil',
+                    'rasters': [
+                        'ssurgo-hydro-groups-30m-epsg5070-512-int8'
+                    ]
+                },
+                {
+                    'name': 'RasterLinesJoin',
+                    'label': 'nlcd_streams',
+                    'rasters': [
+                        'nlcd-2011-30m-epsg5070-512-int8'
+                    ]
+                },
+            ] + CLIMATE_OPERATIONS
+        },
         'mapshed': {
             'shapes': [],
             'streamLines': '',